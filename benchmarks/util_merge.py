@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the merge helpers of util.py.
+
+Compares the helpers with their previous deep copying implementations on
+the real tables: the SENSORS of this integration merged with the SENSORS of
+the Tuya integration, as done when the sensor platform is set up.
+
+Run from the repository root, in an environment where Home Assistant and
+the Tuya SDKs are installed:
+    python benchmarks/util_merge.py
+"""
+
+from __future__ import annotations
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from homeassistant.components.tuya.sensor import SENSORS as SENSORS_TUYA  # noqa: E402
+
+from custom_components.xtend_tuya import util  # noqa: E402
+from custom_components.xtend_tuya.sensor import SENSORS  # noqa: E402
+
+#Previous implementations, deep copying every value
+def previous_merge_device_descriptors(descriptors1, descriptors2):
+    return_descriptors = copy.deepcopy(descriptors1)
+    for category in descriptors2:
+        if category not in return_descriptors:
+            return_descriptors[category] = copy.deepcopy(descriptors2[category])
+        else:
+            return_descriptors[category] = previous_merge_descriptor_category(return_descriptors[category], descriptors2[category])
+    return return_descriptors
+
+def previous_merge_descriptor_category(category1, category2):
+    descriptor1_key_list = []
+    return_category = copy.deepcopy(list(category1))
+    for descriptor in category1:
+        if descriptor.key not in descriptor1_key_list:
+            descriptor1_key_list.append(descriptor.key)
+    for descriptor in category2:
+        if descriptor.key not in descriptor1_key_list:
+            return_category.append(copy.deepcopy(descriptor))
+    return tuple(return_category)
+
+def previous_append_lists(list1, list2):
+    return_list = copy.deepcopy(list(list1))
+    for item in list2:
+        if item not in return_list:
+            return_list.append(copy.deepcopy(item))
+    return return_list
+
+def bench(name: str, function, number: int = 20) -> float:
+    duration = min(timeit.repeat(function, number=number, repeat=3)) / number
+    print(f"{name:<45} {duration * 1000:8.3f} ms")
+    return duration
+
+def main() -> None:
+    print(f"SENSORS: {len(SENSORS)} categories, Tuya SENSORS: {len(SENSORS_TUYA)} categories")
+    bench("merge_device_descriptors (previous)", lambda: previous_merge_device_descriptors(SENSORS, SENSORS_TUYA))
+    #The merged table is cached after the first call, measure the merge itself then the cached call
+    bench("merge_device_descriptors (uncached merge)", lambda: util._merge_device_descriptors(SENSORS, SENSORS_TUYA))
+    bench("merge_device_descriptors", lambda: util.merge_device_descriptors(SENSORS, SENSORS_TUYA))
+
+    bench("append_lists (previous)", lambda: previous_append_lists(list(SENSORS), list(SENSORS_TUYA)))
+    bench("append_lists", lambda: util.append_lists(list(SENSORS), list(SENSORS_TUYA)))
+
+    #merge_iterables fills both mappings, merge copies of the tables
+    bench("merge_iterables (deep_copy=True)", lambda: util.merge_iterables(dict(SENSORS), dict(SENSORS_TUYA)))
+    bench("merge_iterables (deep_copy=False)", lambda: util.merge_iterables(dict(SENSORS), dict(SENSORS_TUYA), deep_copy=False))
+
+if __name__ == "__main__":
+    main()
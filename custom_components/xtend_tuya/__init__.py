@@ -4,14 +4,18 @@ from __future__ import annotations
 import logging
 
 from homeassistant.config_entries import ConfigEntry, ConfigEntryState
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryAuthFailed, ConfigEntryNotReady
 from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.event import async_call_later
+from typing import Any
 
 from .const import (
     DOMAIN,
     DOMAIN_ORIG,
+    LOGGER,
     PLATFORMS,
+    DEVICE_CACHE_REFRESH_RETRY_DELAY,
 )
 
 from .multi_manager.multi_manager import (
@@ -20,6 +24,14 @@ from .multi_manager.multi_manager import (
     HomeAssistantXTData,
 )
 
+from .multi_manager.shared.device_snapshot import (
+    XTDeviceSnapshot,
+)
+
+from .multi_manager.tuya_iot.xt_tuya_iot_model_cache import (
+    XTIOTModelCache,
+)
+
 from .multi_manager.tuya_sharing.tuya_decorators import (
     decorate_tuya_integration
 )
@@ -42,19 +54,23 @@ async def async_setup_entry(hass: HomeAssistant, entry: XTConfigEntry) -> bool:
     decorate_tuya_integration(multi_manager)
     await multi_manager.setup_entry(hass)
 
+    # Restore the devices from the last snapshot, they are refreshed once the entities are set up
+    warm_start = await multi_manager.async_restore_device_cache_snapshot()
+
     # Get all devices from Tuya
-    try:
-        await hass.async_add_executor_job(multi_manager.update_device_cache)
-    except Exception as exc:
-        # While in general, we should avoid catching broad exceptions,
-        # we have no other way of detecting this case.
-        if "sign invalid" in str(exc):
-            msg = "Authentication failed. Please re-authenticate the Tuya integration"
-            if multi_manager.reuse_config:
-                raise ConfigEntryNotReady(msg) from exc
-            else:
-                raise ConfigEntryAuthFailed("Authentication failed. Please re-authenticate.")
-        raise
+    if not warm_start:
+        try:
+            await hass.async_add_executor_job(multi_manager.update_device_cache)
+        except Exception as exc:
+            # While in general, we should avoid catching broad exceptions,
+            # we have no other way of detecting this case.
+            if "sign invalid" in str(exc):
+                msg = "Authentication failed. Please re-authenticate the Tuya integration"
+                if multi_manager.reuse_config:
+                    raise ConfigEntryNotReady(msg) from exc
+                else:
+                    raise ConfigEntryAuthFailed("Authentication failed. Please re-authenticate.")
+            raise
 
     # Connection is successful, store the manager & listener
     entry.runtime_data = HomeAssistantXTData(multi_manager=multi_manager, reuse_config=multi_manager.reuse_config, listener=multi_manager.multi_device_listener)
@@ -65,7 +81,7 @@ async def async_setup_entry(hass: HomeAssistant, entry: XTConfigEntry) -> bool:
     # Register known device IDs
     device_registry = dr.async_get(hass)
     aggregated_device_map = multi_manager.device_map
-    for device in aggregated_device_map.values():
+    for device in list(aggregated_device_map.values()):
         if multi_manager.reuse_config:
             if device_registry.async_get_device(identifiers={(DOMAIN_ORIG, device.id)}, connections=None):
                 identifiers = {(DOMAIN_ORIG, device.id), (DOMAIN, device.id)}
@@ -83,14 +99,47 @@ async def async_setup_entry(hass: HomeAssistant, entry: XTConfigEntry) -> bool:
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
-    for device in aggregated_device_map.values():
+    for device in list(multi_manager.device_map.values()):
         multi_manager.apply_init_virtual_states(device)
         multi_manager.allow_virtual_devices_not_set_up(device)
+    multi_manager.device_snapshot.async_track_saves(entry)
     # If the device does not register any entities, the device does not need to subscribe
     # So the subscription is here
     await hass.async_add_executor_job(multi_manager.refresh_mq)
+    if warm_start:
+        # The restored devices receive their reports while they are refreshed
+        entry.async_create_background_task(hass, async_refresh_device_cache(hass, entry, multi_manager), f"{DOMAIN} device cache refresh")
+        return True
+    multi_manager.device_snapshot.async_schedule_save()
     return True
 
+async def async_refresh_device_cache(hass: HomeAssistant, entry: XTConfigEntry, multi_manager: MultiManager) -> None:
+    """Refresh the devices restored from the snapshot."""
+    try:
+        device_list_changed = await hass.async_add_executor_job(multi_manager.refresh_device_cache)
+    except Exception as exc:
+        if "sign invalid" in str(exc):
+            entry.async_start_reauth(hass)
+            return
+        LOGGER.warning(f"Refreshing the device cache failed, keeping the devices from the snapshot and retrying later: {exc}")
+
+        @callback
+        def async_retry_refresh(_: Any) -> None:
+            entry.async_create_background_task(hass, async_refresh_device_cache(hass, entry, multi_manager), f"{DOMAIN} device cache refresh")
+        entry.async_on_unload(async_call_later(hass, DEVICE_CACHE_REFRESH_RETRY_DELAY, async_retry_refresh))
+        return
+    if device_list_changed:
+        # Devices were added or removed since the snapshot, set them up from scratch
+        multi_manager.device_snapshot.async_schedule_save()
+        hass.config_entries.async_schedule_reload(entry.entry_id)
+        return
+    for device in list(multi_manager.device_map.values()):
+        multi_manager.apply_init_virtual_states(device)
+        multi_manager.allow_virtual_devices_not_set_up(device)
+    # The homes are not part of the snapshot, subscribe to their topics now that they are known
+    await hass.async_add_executor_job(multi_manager.refresh_mq)
+    multi_manager.device_snapshot.async_schedule_save()
+
 
 async def cleanup_device_registry(hass: HomeAssistant, multi_manager: MultiManager, current_entry: ConfigEntry) -> None:
     """Remove deleted device registry entry if there are no remaining entities."""
@@ -142,6 +191,7 @@ async def async_unload_entry(hass: HomeAssistant, entry: XTConfigEntry) -> bool:
     """Unloading the Tuya platforms."""
     if unload_ok := await hass.config_entries.async_unload_platforms(entry, PLATFORMS):
         tuya = entry.runtime_data
+        await tuya.manager.device_snapshot.async_save()
         if tuya.manager.mq is not None:
             tuya.manager.mq.stop()
         tuya.manager.remove_device_listeners()
@@ -154,6 +204,8 @@ async def async_remove_entry(hass: HomeAssistant, entry: XTConfigEntry) -> None:
 
     This will revoke the credentials from Tuya.
     """
+    await XTIOTModelCache.async_remove(hass, entry.entry_id)
+    await XTDeviceSnapshot.async_remove(hass, entry.entry_id)
     if not entry.reuse_config:
         multi_manager = entry.multi_manager
         await hass.async_add_executor_job(multi_manager.unload)
\ No newline at end of file
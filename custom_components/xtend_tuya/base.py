@@ -4,19 +4,19 @@ from __future__ import annotations
 
 import base64
 from dataclasses import dataclass
+from functools import lru_cache
 import json
 import struct
 from typing import Any, Literal, Self, overload
 
 from homeassistant.helpers.device_registry import DeviceInfo
-from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import Entity
 
 from homeassistant.components.tuya.const import (
     DPCode as DPCode_tuya
 )
 
-from .const import DOMAIN, TUYA_HA_SIGNAL_UPDATE_ENTITY, DPCode, DPType, LOGGER
+from .const import DOMAIN, DPCode, DPType, LOGGER
 from .util import remap_value
 from .multi_manager.multi_manager import MultiManager, XTDevice
 
@@ -108,6 +108,19 @@ class EnumTypeData:
         return cls(dpcode, **parsed)
 
 
+@lru_cache(maxsize=4096, typed=True)
+def _parse_type_data(type_data_class: type, dpcode: DPCode, data: str) -> IntegerTypeData | EnumTypeData | None:
+    #Keyed by the values JSON so that the devices of a same product share the parsed data and
+    #a specification whose values are overwritten (ie: by get_device_properties) misses the cache
+    return type_data_class.from_json(dpcode, data)
+
+def parse_type_data(type_data_class: type, dpcode: DPCode, data: str) -> IntegerTypeData | EnumTypeData | None:
+    """Return the type data parsed from a specification values JSON, cached across calls."""
+    if not isinstance(data, str):
+        return type_data_class.from_json(dpcode, data)
+    return _parse_type_data(type_data_class, dpcode, data)
+
+
 @dataclass
 class ElectricityTypeData:
     """Electricity Type Data."""
@@ -225,8 +238,8 @@ class TuyaEntity(Entity):
                     and getattr(self.device, key)[dpcode].type == DPType.ENUM
                 ):
                     if not (
-                        enum_type := EnumTypeData.from_json(
-                            dpcode, getattr(self.device, key)[dpcode].values
+                        enum_type := parse_type_data(
+                            EnumTypeData, dpcode, getattr(self.device, key)[dpcode].values
                         )
                     ):
                         continue
@@ -238,8 +251,8 @@ class TuyaEntity(Entity):
                 ):
                     try:
                         if not (
-                            integer_type := IntegerTypeData.from_json(
-                                dpcode, getattr(self.device, key)[dpcode].values
+                            integer_type := parse_type_data(
+                                IntegerTypeData, dpcode, getattr(self.device, key)[dpcode].values
                             )
                         ):
                             continue
@@ -291,13 +304,17 @@ class TuyaEntity(Entity):
     async def async_added_to_hass(self) -> None:
         """Call when entity is added to hass."""
         self.async_on_remove(
-            async_dispatcher_connect(
-                self.hass,
-                f"{TUYA_HA_SIGNAL_UPDATE_ENTITY}_{self.device.id}",
+            self.device_manager.multi_device_listener.async_subscribe_entity_updates(
+                self.device.id,
+                self.get_dependent_dp_codes(),
                 self.async_write_ha_state,
             )
         )
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on, None if it depends on the whole device."""
+        return None
+
     def _send_command(self, commands: list[dict[str, Any]]) -> None:
         """Send command to the device."""
         #LOGGER.debug("Sending commands for device %s: %s", self.device.id, commands)
@@ -40,6 +40,8 @@ from .const import (
     CONF_COUNTRY_CODE,
     CONF_PASSWORD,
     CONF_USERNAME,
+    CONF_COMMAND_COALESCE_WINDOW,
+    COMMAND_COALESCE_WINDOW,
     SMARTLIFE_APP,
     TUYA_COUNTRIES,
     TUYA_SMART_APP,
@@ -108,6 +110,15 @@ class TuyaOptionFlow(OptionsFlow):
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Manage the options."""
+        return self.async_show_menu(
+            step_id="init",
+            menu_options=["iot_credentials", "commands"],
+        )
+
+    async def async_step_iot_credentials(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the Tuya IoT credentials."""
         errors = {}
         placeholders = {}
 
@@ -126,7 +137,7 @@ class TuyaOptionFlow(OptionsFlow):
 
                 return self.async_create_entry(
                     title="",
-                    data=data,
+                    data={**self.options, **data},
                 )
             errors["base"] = "login_error"
             placeholders = {
@@ -147,7 +158,7 @@ class TuyaOptionFlow(OptionsFlow):
                         break
 
         return self.async_show_form(
-            step_id="init",
+            step_id="iot_credentials",
             data_schema=vol.Schema(
                 {
                     vol.Optional(
@@ -179,6 +190,28 @@ class TuyaOptionFlow(OptionsFlow):
             description_placeholders=placeholders,
         )
 
+    async def async_step_commands(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage the command options, they don't need the Tuya IoT credentials."""
+        if user_input is not None:
+            return self.async_create_entry(
+                title="",
+                data={**self.options, **user_input},
+            )
+
+        return self.async_show_form(
+            step_id="commands",
+            data_schema=vol.Schema(
+                {
+                    vol.Optional(
+                        CONF_COMMAND_COALESCE_WINDOW,
+                        default=self.options.get(CONF_COMMAND_COALESCE_WINDOW, COMMAND_COALESCE_WINDOW)
+                    ): vol.All(vol.Coerce(float), vol.Range(min=0, max=5)),
+                }
+            ),
+        )
+
 class TuyaConfigFlow(ConfigFlow, domain=DOMAIN):
     """Tuya config flow."""
 
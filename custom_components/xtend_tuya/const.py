@@ -48,6 +48,7 @@ CONF_USERNAME = "username"
 CONF_PASSWORD = "password"
 CONF_COUNTRY_CODE = "country_code"
 CONF_APP_TYPE = "tuya_app_type"
+CONF_COMMAND_COALESCE_WINDOW = "command_coalesce_window"
 
 TUYA_CLIENT_ID = "HA_3y9q4ak7g4ephrvke"
 TUYA_SCHEMA = "haauthorize"
@@ -70,6 +71,16 @@ SMARTLIFE_APP = "smartlife"
 MESSAGE_SOURCE_TUYA_IOT = "tuya_iot"
 MESSAGE_SOURCE_TUYA_SHARING = "tuya_sharing"
 
+IOT_REQUEST_TIMEOUT = 10                #Timeout (in seconds) of each Open API request
+SHARING_DEVICE_FETCH_MAX_CONCURRENCY = 8    #Maximum number of devices whose specifications/strategies are fetched in parallel from the sharing API
+DEVICE_UPDATE_COALESCE_DELAY = 0.05     #Window (in seconds) during which the updates of a device are merged before notifying its entities
+COMMAND_COALESCE_WINDOW = 0.3           #Default window (in seconds) after a command during which the next commands sent to a device are merged, 0 disables it
+MQTT_QUEUE_MAX_MESSAGES = 5000          #Maximum number of MQTT messages waiting to be processed
+MQTT_QUEUE_MAX_DEVICE_MESSAGES = 100    #Maximum number of MQTT messages of a single device waiting to be processed, the oldest are dropped
+REPORT_DEDUPLICATION_WINDOW = 30       #Time (in seconds) during which a report received from one account is ignored when received again from the other
+DEVICE_CACHE_REFRESH_RETRY_DELAY = 60   #Delay (in seconds) before retrying a failed refresh of the devices restored from the snapshot
+HTTP_MAX_HOST_CONCURRENCY = 8           #Maximum number of concurrent non blocking requests sent to a same cloud host
+
 PLATFORMS = [
     Platform.ALARM_CONTROL_PANEL,
     Platform.BINARY_SENSOR,
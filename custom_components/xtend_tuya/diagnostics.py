@@ -14,7 +14,7 @@ from homeassistant.helpers import device_registry as dr, entity_registry as er
 from homeassistant.helpers.device_registry import DeviceEntry
 from homeassistant.util import dt as dt_util
 
-from .multi_manager.multi_manager import XTConfigEntry
+from .multi_manager.multi_manager import MultiManager, XTConfigEntry, XTDevice
 from .const import DOMAIN, DPCode
 
 
@@ -49,6 +49,7 @@ def _async_get_diagnostics(
         #"endpoint": hass_data.manager.customer_api.endpoint,
         #"terminal_id": hass_data.manager.terminal_id,
         "mqtt_connected": mqtt_connected,
+        "mqtt_queue": hass_data.manager.multi_mqtt_queue.get_queue_metrics(),
         "disabled_by": entry.disabled_by,
         "disabled_polling": entry.pref_disable_polling,
     }
@@ -57,13 +58,13 @@ def _async_get_diagnostics(
         tuya_device_id = next(iter(device.identifiers))[1]
         if tuya_device_id in hass_data.manager.device_map:
             data |= _async_device_as_dict(
-                hass, hass_data.manager.device_map[tuya_device_id]
+                hass, hass_data.manager, hass_data.manager.device_map[tuya_device_id]
             )
     else:
         data.update(
             devices=[
-                _async_device_as_dict(hass, device)
-                for device in hass_data.manager.device_map.values()
+                _async_device_as_dict(hass, hass_data.manager, device)
+                for device in list(hass_data.manager.device_map.values())
             ]
         )
 
@@ -72,7 +73,7 @@ def _async_get_diagnostics(
 
 @callback
 def _async_device_as_dict(
-    hass: HomeAssistant, device: CustomerDevice
+    hass: HomeAssistant, manager: MultiManager, device: CustomerDevice
 ) -> dict[str, Any]:
     """Represent a Tuya device as a dictionary."""
 
@@ -113,6 +114,7 @@ def _async_device_as_dict(
         "set_up": set_up,
         "support_local": support_local,
         "data_model": data_model,
+        "command_routes": manager.get_device_command_routes(device).as_dict(),
     }
 
     # Gather Tuya states
@@ -126,6 +128,8 @@ def _async_device_as_dict(
             value = json.loads(value)
         data["status"][dpcode] = value
 
+    dp_code_index = XTDevice.get_dp_code_index(device)
+
     # Gather Tuya functions
     for function in device.function.values():
         value = function.values
@@ -133,11 +137,8 @@ def _async_device_as_dict(
             value = json.loads(cast(str, function.values))
 
         property_update = False
-
-        for dp_item in device.local_strategy.values():
-            if dp_item["status_code"] == function.code:
-                property_update = dp_item.get("property_update", False)
-                break
+        if (dp_id := dp_code_index.code_to_dp_id.get(function.code, None)) is not None:
+            property_update = device.local_strategy[dp_id].get("property_update", False)
 
         data["function"][function.code] = {
             "type": function.type,
@@ -152,11 +153,8 @@ def _async_device_as_dict(
             value = json.loads(status_range.values)
 
         property_update = False
-
-        for dp_item in device.local_strategy.values():
-            if dp_item["status_code"] == status_range.code:
-                property_update = dp_item.get("property_update", False)
-                break
+        if (dp_id := dp_code_index.code_to_dp_id.get(status_range.code, None)) is not None:
+            property_update = device.local_strategy[dp_id].get("property_update", False)
 
         data["status_range"][status_range.code] = {
             "type": status_range.type,
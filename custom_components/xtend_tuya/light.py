@@ -216,6 +216,15 @@ class TuyaLightEntity(TuyaEntity, LightEntity):
             # If the light supports only a single color mode, set it now
             self._fixed_color_mode = next(iter(self._attr_supported_color_modes))
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on."""
+        dp_codes = {self.entity_description.key, self._color_mode_dpcode, self._color_data_dpcode}
+        for type_data in (self._brightness, self._brightness_max, self._brightness_min, self._color_temp):
+            if type_data is not None:
+                dp_codes.add(type_data.dpcode)
+        dp_codes.discard(None)
+        return dp_codes
+
     @property
     def is_on(self) -> bool:
         """Return true if light is on."""
@@ -1,13 +1,18 @@
 from __future__ import annotations
+import asyncio
 import requests
 import copy
-from typing import NamedTuple, Any
+import threading
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+from typing import NamedTuple, Any, Callable
 
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.config_entries import ConfigEntry
 import homeassistant.components.tuya as tuya_integration
-from homeassistant.helpers.dispatcher import dispatcher_send
+from homeassistant.helpers.dispatcher import dispatcher_send, async_dispatcher_send
 from homeassistant.helpers import device_registry as dr
 from homeassistant.helpers.entity import EntityDescription
 
@@ -49,7 +54,6 @@ from ..const import (
     TUYA_CLIENT_ID,
     TUYA_DISCOVERY_NEW,
     TUYA_DISCOVERY_NEW_ORIG,
-    TUYA_HA_SIGNAL_UPDATE_ENTITY,
     TUYA_HA_SIGNAL_UPDATE_ENTITY_ORIG,
     VirtualStates,
     VirtualFunctions,
@@ -65,6 +69,11 @@ from ..const import (
     CONF_USERNAME,
     MESSAGE_SOURCE_TUYA_IOT,
     MESSAGE_SOURCE_TUYA_SHARING,
+    DEVICE_UPDATE_COALESCE_DELAY,
+    COMMAND_COALESCE_WINDOW,
+    CONF_COMMAND_COALESCE_WINDOW,
+    MQTT_QUEUE_MAX_MESSAGES,
+    MQTT_QUEUE_MAX_DEVICE_MESSAGES,
 )
 
 from .shared.import_stub import (
@@ -75,8 +84,23 @@ from .shared.import_stub import (
 from .shared.shared_classes import (
     XTDeviceProperties,
     XTDevice,
+    XTDeviceMap,
+    XTDeviceSpecificationPool,
+    XTDeviceCommandRoutes,
+    XTCommandBackend,
+    XTVirtualStatesApplication,
+    VIRTUAL_DP_ID_BASE,
 )
 
+from .shared.device_snapshot import (
+    XTDeviceSnapshot,
+)
+from .shared.async_http_client import (
+    XTAsyncHTTPClient,
+)
+from .shared.rate_limiter import (
+    XTRateLimiter,
+)
 from .shared.multi_source_handler import (
     MultiSourceHandler,
 )
@@ -84,7 +108,6 @@ from .shared.multi_source_handler import (
 from ..util import (
     get_overriden_tuya_integration_runtime_data,
     get_tuya_integration_runtime_data,
-    prepare_value_for_property_update,
     merge_iterables,
     append_lists,
 )
@@ -97,11 +120,14 @@ from .tuya_sharing.xt_tuya_sharing import (
     XTSharingDeviceManager,
     XTSharingTokenListener,
     XTSharingDeviceRepository,
+    XTSharingRateLimitedApi,
 )
 from .tuya_iot.xt_tuya_iot import (
     XTIOTDeviceManager,
+    XTIOTAsyncOpenAPI,
     XTIOTHomeManager,
 )
+from .tuya_iot.xt_tuya_iot_model_cache import XTIOTModelCache
 
 class HomeAssistantXTData(NamedTuple):
     """Tuya data stored in the Home Assistant data object."""
@@ -129,6 +155,15 @@ class MultiMQTTQueue:
         self.multi_manager = multi_manager
         self.sharing_account_mq = None
         self.iot_account_mq = None
+        #Messages received on the MQTT threads waiting to be processed, grouped by device
+        self.pending_messages: dict[str | None, deque[tuple[str, dict[str, Any]]]] = {}
+        self.pending_message_count: int = 0
+        self.max_pending_message_count: int = 0
+        self.processed_message_count: int = 0
+        self.dropped_message_count: int = 0
+        self.pending_messages_lock = threading.Lock()
+        self.message_event: asyncio.Event | None = None
+        self.wakeup_scheduled = False
 
     def stop(self) -> None:
         if self.sharing_account_mq and not self.multi_manager.reuse_config:
@@ -136,18 +171,242 @@ class MultiMQTTQueue:
         if self.iot_account_mq:
             self.iot_account_mq.stop()
 
+    @callback
+    def async_start(self, hass: HomeAssistant, entry: ConfigEntry) -> None:
+        self.message_event = asyncio.Event()
+        entry.async_create_background_task(hass, self._async_consume_messages(hass), f"{DOMAIN} MQTT message queue")
+        with self.pending_messages_lock:
+            if self.pending_message_count > 0:
+                self.message_event.set()
+
+    def put_message(self, source: str, msg: dict[str, Any]) -> None:
+        #Called on the MQTT threads, the messages are processed in batches by a single consumer
+        dev_id = self.multi_manager._get_device_id_from_message(msg)
+        with self.pending_messages_lock:
+            device_messages = self.pending_messages.get(dev_id, None)
+            if device_messages is None:
+                device_messages = self.pending_messages[dev_id] = deque()
+            if len(device_messages) >= MQTT_QUEUE_MAX_DEVICE_MESSAGES or self.pending_message_count >= MQTT_QUEUE_MAX_MESSAGES:
+                self.dropped_message_count += 1
+                if not device_messages:
+                    #The queue is full of the messages of other devices
+                    return
+                device_messages.popleft()
+                self.pending_message_count -= 1
+            device_messages.append((source, msg))
+            self.pending_message_count += 1
+            self.max_pending_message_count = max(self.max_pending_message_count, self.pending_message_count)
+            if self.wakeup_scheduled or self.message_event is None:
+                return
+            self.wakeup_scheduled = True
+        self.multi_manager.hass.loop.call_soon_threadsafe(self.message_event.set)
+
+    async def _async_consume_messages(self, hass: HomeAssistant) -> None:
+        dropped_message_count = 0
+        while True:
+            await self.message_event.wait()
+            self.message_event.clear()
+            with self.pending_messages_lock:
+                pending_messages = self.pending_messages
+                self.pending_messages = {}
+                self.pending_message_count = 0
+                self.wakeup_scheduled = False
+                new_dropped_message_count = self.dropped_message_count
+            if new_dropped_message_count != dropped_message_count:
+                LOGGER.warning(f"MQTT message queue overloaded, {new_dropped_message_count - dropped_message_count} messages were dropped")
+                dropped_message_count = new_dropped_message_count
+            #The queue state is only modified here and under the lock, the batch itself is owned by the executor job
+            processed_message_count = await hass.async_add_executor_job(self._process_messages, pending_messages)
+            with self.pending_messages_lock:
+                self.processed_message_count += processed_message_count
+
+    def _process_messages(self, pending_messages: dict[str | None, deque[tuple[str, dict[str, Any]]]]) -> int:
+        processed_message_count = 0
+        for device_messages in pending_messages.values():
+            for source, msg in device_messages:
+                try:
+                    self.multi_manager.process_message(source, msg)
+                except Exception as e:
+                    LOGGER.warning(f"Processing of MQTT message failed: {e}")
+                processed_message_count += 1
+        return processed_message_count
+
+    def get_queue_metrics(self) -> dict[str, int]:
+        with self.pending_messages_lock:
+            return {
+                "pending_messages": self.pending_message_count,
+                "max_pending_messages": self.max_pending_message_count,
+                "processed_messages": self.processed_message_count,
+                "dropped_messages": self.dropped_message_count,
+            }
+
+class MultiCommandCoalescer:
+    def __init__(self, hass: HomeAssistant, multi_manager: MultiManager, window: float = COMMAND_COALESCE_WINDOW) -> None:
+        self.hass = hass
+        self.multi_manager = multi_manager
+        self.window = window
+        #device_id => (code => command, future of the batch), the devices whose window is open
+        #and the commands waiting for the end of it
+        self.pending_commands: dict[str, tuple[dict[str, dict[str, Any]], Future]] = {}
+        self.pending_commands_lock = threading.Lock()
+        self.device_send_locks: dict[str, threading.Lock] = {}
+
+    def send_commands(self, device_id: str, commands: list[dict[str, Any]]) -> None:
+        """Send the commands of a device, grouping those sent in a burst.
+
+        The commands sent while no window is open are sent right away and open a
+        window, those sent during the window are sent in a single batch at its end.
+        From a worker thread, returns once the commands are sent and raises their
+        errors. From the event loop, the commands are sent by a worker thread and
+        their errors are logged.
+        """
+        future = self._add_commands(device_id, commands)
+        if future is None:
+            future = Future()
+            if threading.get_ident() != self.hass.loop_thread_id:
+                self._send_device_commands(device_id, commands, future)
+            else:
+                self.hass.async_add_executor_job(self._send_device_commands, device_id, commands, future)
+        if threading.get_ident() == self.hass.loop_thread_id:
+            future.add_done_callback(partial(self._log_send_error, device_id))
+            return
+        future.result()
+
+    def _add_commands(self, device_id: str, commands: list[dict[str, Any]]) -> Future | None:
+        #Returns the future of the batch the commands were added to, None if they have to be sent right away
+        if self.window <= 0:
+            return None
+        with self.pending_commands_lock:
+            pending = self.pending_commands.get(device_id, None)
+            if pending is None:
+                self.pending_commands[device_id] = ({}, Future())
+                self.hass.loop.call_soon_threadsafe(self._async_schedule_flush, device_id)
+                return None
+            device_commands, future = pending
+            for command in commands:
+                #Last write wins, the DP keeps its position in the batch
+                device_commands[command["code"]] = command
+        return future
+
+    @callback
+    def _async_schedule_flush(self, device_id: str) -> None:
+        self.hass.loop.call_later(self.window, self._async_flush_device_commands, device_id)
+
+    @callback
+    def _async_flush_device_commands(self, device_id: str) -> None:
+        with self.pending_commands_lock:
+            device_commands, future = self.pending_commands[device_id]
+            if not device_commands:
+                #Nothing was sent during the window, close it
+                del self.pending_commands[device_id]
+                future.set_result(None)
+                return
+        self.hass.async_add_executor_job(self._flush_device_commands, device_id)
+
+    def _flush_device_commands(self, device_id: str) -> None:
+        #The window stays open until the batch is taken, the commands sent meanwhile join it
+        with self._get_device_send_lock(device_id):
+            with self.pending_commands_lock:
+                device_commands, future = self.pending_commands.pop(device_id)
+            self._send_device_commands_locked(device_id, list(device_commands.values()), future)
+
+    def _send_device_commands(self, device_id: str, commands: list[dict[str, Any]], future: Future) -> None:
+        #Commands of a device are sent one batch at a time so that they can't be reordered
+        with self._get_device_send_lock(device_id):
+            self._send_device_commands_locked(device_id, commands, future)
+
+    def _send_device_commands_locked(self, device_id: str, commands: list[dict[str, Any]], future: Future) -> None:
+        try:
+            self.multi_manager.send_commands_now(device_id, commands)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    def _log_send_error(self, device_id: str, future: Future) -> None:
+        if (exception := future.exception()) is not None:
+            LOGGER.warning(f"Sending commands to device {device_id} failed: {exception}")
+
+    def _get_device_send_lock(self, device_id: str) -> threading.Lock:
+        with self.pending_commands_lock:
+            if device_id not in self.device_send_locks:
+                self.device_send_locks[device_id] = threading.Lock()
+            return self.device_send_locks[device_id]
+
 class MultiDeviceListener:
     def __init__(self, hass: HomeAssistant, multi_manager: MultiManager) -> None:
         self.multi_manager = multi_manager
         self.hass = hass
+        self.reported_dp_codes: dict[str, set[str] | None] = {}
+        self.pending_updates: dict[str, set[str] | None] = {}
+        self.pending_updates_lock = threading.Lock()
+        self.flush_scheduled = False
+        self.entity_subscriptions: dict[str, dict[str | None, set[Callable[[], None]]]] = {}
+
+    def add_reported_dp_codes(self, device_id: str, dp_codes: set[str] | None) -> None:
+        #Called right before the SDK calls update_device for a report, None means that any DP may have changed
+        with self.pending_updates_lock:
+            self.reported_dp_codes[device_id] = dp_codes
 
     def update_device(self, device: XTDevice):
         devices = self.multi_manager.get_devices_from_device_id(device.id)
         for cur_device in devices:
             XTDevice.copy_data_from_device(device, cur_device)
-        #if self.multi_manager.reuse_config:
-        dispatcher_send(self.hass, f"{TUYA_HA_SIGNAL_UPDATE_ENTITY_ORIG}_{device.id}")
-        dispatcher_send(self.hass, f"{TUYA_HA_SIGNAL_UPDATE_ENTITY}_{device.id}")
+        with self.pending_updates_lock:
+            updated_dp_codes = self.reported_dp_codes.pop(device.id, None)
+            if device.id not in self.pending_updates:
+                self.pending_updates[device.id] = updated_dp_codes
+            elif (pending_dp_codes := self.pending_updates[device.id]) is not None:
+                if updated_dp_codes is None:
+                    self.pending_updates[device.id] = None
+                else:
+                    pending_dp_codes.update(updated_dp_codes)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        #Updates coming from both accounts and bursts of reports are merged into a single notification
+        self.hass.loop.call_soon_threadsafe(self.hass.loop.call_later, DEVICE_UPDATE_COALESCE_DELAY, self.async_flush_device_updates)
+
+    @callback
+    def async_flush_device_updates(self) -> None:
+        with self.pending_updates_lock:
+            pending_updates = self.pending_updates
+            self.pending_updates = {}
+            self.flush_scheduled = False
+        for device_id, updated_dp_codes in pending_updates.items():
+            #if self.multi_manager.reuse_config:
+            async_dispatcher_send(self.hass, f"{TUYA_HA_SIGNAL_UPDATE_ENTITY_ORIG}_{device_id}")
+            for update_callback in self._get_entity_update_callbacks(device_id, updated_dp_codes):
+                update_callback()
+
+    def _get_entity_update_callbacks(self, device_id: str, updated_dp_codes: set[str] | None) -> set[Callable[[], None]]:
+        if not (device_subscriptions := self.entity_subscriptions.get(device_id, None)):
+            return set()
+        if updated_dp_codes is None:
+            return set().union(*device_subscriptions.values())
+        update_callbacks = set(device_subscriptions.get(None, ()))
+        for dp_code in updated_dp_codes:
+            update_callbacks.update(device_subscriptions.get(dp_code, ()))
+        return update_callbacks
+
+    @callback
+    def async_subscribe_entity_updates(self, device_id: str, dp_codes: set[str] | None, update_callback: Callable[[], None]) -> Callable[[], None]:
+        #Entities subscribe to the DP codes they read, None subscribes to any update of the device
+        device_subscriptions = self.entity_subscriptions.setdefault(device_id, {})
+        subscription_keys = [None] if dp_codes is None else list(dp_codes)
+        for subscription_key in subscription_keys:
+            device_subscriptions.setdefault(subscription_key, set()).add(update_callback)
+
+        @callback
+        def async_unsubscribe() -> None:
+            for subscription_key in subscription_keys:
+                if subscribers := device_subscriptions.get(subscription_key, None):
+                    subscribers.discard(update_callback)
+                    if not subscribers:
+                        device_subscriptions.pop(subscription_key, None)
+            if not device_subscriptions:
+                self.entity_subscriptions.pop(device_id, None)
+        return async_unsubscribe
 
     def add_device(self, device: XTDevice):
         self.hass.add_job(self.async_remove_device, device.id)
@@ -182,23 +441,38 @@ class MultiManager:  # noqa: F811
         self.reuse_config: bool = False
         self.descriptors_with_virtual_state = {}
         self.descriptors_with_virtual_function = {}
+        self.category_virtual_states: dict[str, tuple[DescriptionVirtualState, ...]] = {}
+        self.category_virtual_state_keys: dict[str, frozenset[str]] = {}
+        self.category_virtual_functions: dict[str, tuple[DescriptionVirtualFunction, ...]] = {}
         self.multi_mqtt_queue: MultiMQTTQueue = MultiMQTTQueue(self)
         self.multi_device_listener: MultiDeviceListener = MultiDeviceListener(hass, self)
+        self.command_coalescer: MultiCommandCoalescer = MultiCommandCoalescer(
+            hass, self, (entry.options or {}).get(CONF_COMMAND_COALESCE_WINDOW, COMMAND_COALESCE_WINDOW)
+        )
         self.config_entry = entry
         self.hass = hass
         self.multi_source_handler = MultiSourceHandler(self)
+        self.aggregated_device_map: dict[str, XTDevice] = {}
+        self.device_sources_map: dict[str, tuple[XTDevice, ...]] = {}
+        self.device_map_version: int = 0
+        self.device_specification_pool = XTDeviceSpecificationPool()
+        self.device_snapshot = XTDeviceSnapshot(hass, entry.entry_id, self.get_device_cache_snapshot)
+        self.http_client = XTAsyncHTTPClient(hass)
+        self.rate_limiter = XTRateLimiter(hass)
 
     @property
     def device_map(self):
-        return self.get_aggregated_device_map()
+        return self.aggregated_device_map
     
     @property
     def mq(self):
         return self.multi_mqtt_queue
 
     async def setup_entry(self, hass: HomeAssistant) -> None:
+        self.multi_mqtt_queue.async_start(hass, self.config_entry)
         self.sharing_account = await self.get_sharing_account(hass,self.config_entry)
         self.iot_account     = await self.get_iot_account(hass, self.config_entry)
+        self.rebuild_aggregated_device_map()
 
     async def overriden_tuya_entry_updated(self, hass: HomeAssistant, config_entry: ConfigEntry) -> None:
         LOGGER.warning("overriden_tuya_entry_updated")
@@ -231,10 +505,11 @@ class MultiManager:  # noqa: F811
             sharing_device_manager.mq = None
         self.multi_mqtt_queue.sharing_account_mq = sharing_device_manager.mq
         sharing_device_manager.home_repository = HomeRepository(sharing_device_manager.customer_api)
-        sharing_device_manager.device_repository = XTSharingDeviceRepository(sharing_device_manager.customer_api, sharing_device_manager, self)
+        sharing_device_manager.device_repository = XTSharingDeviceRepository(XTSharingRateLimitedApi(sharing_device_manager.customer_api, self.rate_limiter), sharing_device_manager, self)
         sharing_device_manager.scene_repository = SceneRepository(sharing_device_manager.customer_api)
         sharing_device_manager.user_repository = UserRepository(sharing_device_manager.customer_api)
         sharing_device_manager.add_device_listener(self.multi_device_listener)
+        sharing_device_manager.device_map.add_device_map_listener(self.on_device_map_updated)
         return TuyaSharingData(device_manager=sharing_device_manager, device_ids=[])
 
     async def get_iot_account(self, hass: HomeAssistant, entry: XTConfigEntry) -> TuyaIOTData | None:
@@ -279,10 +554,14 @@ class MultiManager:  # noqa: F811
         mq = TuyaOpenMQ(api)
         self.multi_mqtt_queue.iot_account_mq = mq
         mq.start()
-        device_manager = XTIOTDeviceManager(self, api, mq)
+        model_cache = XTIOTModelCache(hass, entry.entry_id)
+        await model_cache.async_load()
+        async_api = XTIOTAsyncOpenAPI(hass, api, self.http_client, self.rate_limiter)
+        device_manager = XTIOTDeviceManager(self, api, mq, model_cache=model_cache, async_api=async_api)
         device_ids: list[str] = list()
         home_manager = XTIOTHomeManager(api, mq, device_manager, self)
         device_manager.add_device_listener(self.multi_device_listener)
+        device_manager.device_map.add_device_map_listener(self.on_device_map_updated)
         return TuyaIOTData(
             device_manager=device_manager,
             mq=mq,
@@ -300,8 +579,85 @@ class MultiManager:  # noqa: F811
             new_device_ids: list[str] = [device_id for device_id in self.iot_account.device_manager.device_map]
             self.iot_account.device_ids.clear()
             self.iot_account.device_ids.extend(new_device_ids)
+        if self.sharing_account and self.sharing_account.device_manager.get_overriden_device_manager():
+            #The overriden Tuya manager map is not observed, make sure the index is in sync
+            self.rebuild_aggregated_device_map()
         self._merge_devices_from_multiple_sources()
+        self.intern_device_specifications()
+
+    def intern_device_specifications(self) -> None:
+        #Start from a fresh pool so that the specifications of the previous refresh can be released
+        self.device_specification_pool = XTDeviceSpecificationPool()
+        for device_map in self._get_available_device_maps():
+            for device in device_map.values():
+                self.device_specification_pool.intern_device(device)
+        #The command routes reference the interned local_strategy entries
+        self.build_device_command_routes()
     
+    async def async_restore_device_cache_snapshot(self) -> bool:
+        #The devices of an overriden Tuya integration are loaded by the Tuya integration itself
+        if self.reuse_config:
+            return False
+        snapshot = await self.device_snapshot.async_load()
+        if snapshot is None:
+            return False
+        snapshot_accounts = self._get_snapshot_accounts()
+        for account_name in snapshot_accounts:
+            if account_name not in snapshot:
+                #An account was added since the snapshot was taken
+                return False
+        for account_name, account in snapshot_accounts.items():
+            account.device_manager.restore_device_map_from_snapshot(snapshot[account_name])
+            account.device_ids.clear()
+            account.device_ids.extend(account.device_manager.device_map)
+        self.intern_device_specifications()
+        return True
+
+    def get_device_cache_snapshot(self) -> dict[str, Any]:
+        snapshot: dict[str, Any] = {}
+        for account_name, account in self._get_snapshot_accounts().items():
+            snapshot[account_name] = [XTDeviceSnapshot.serialize_device(device) for device in list(account.device_manager.device_map.values())]
+        return snapshot
+
+    def _get_snapshot_accounts(self) -> dict[str, TuyaSharingData | TuyaIOTData]:
+        snapshot_accounts: dict[str, TuyaSharingData | TuyaIOTData] = {}
+        if self.sharing_account:
+            snapshot_accounts[MESSAGE_SOURCE_TUYA_SHARING] = self.sharing_account
+        if self.iot_account:
+            snapshot_accounts[MESSAGE_SOURCE_TUYA_IOT] = self.iot_account
+        return snapshot_accounts
+
+    def refresh_device_cache(self) -> bool:
+        #Refresh the devices restored from the snapshot, returns True if the device list changed.
+        #The devices are fetched into new maps, the restored ones stay visible and routable
+        #until the refreshed data is copied into them
+        refreshed_accounts: list[tuple[TuyaSharingData | TuyaIOTData, XTDeviceMap]] = []
+        if self.sharing_account:
+            refreshed_accounts.append((self.sharing_account, self.sharing_account.device_manager.fetch_refreshed_device_map()))
+        if self.iot_account:
+            refreshed_accounts.append((self.iot_account, self.iot_account.home_manager.fetch_refreshed_device_map()))
+        refreshed_device_ids = [list(refreshed_device_map) for _, refreshed_device_map in refreshed_accounts]
+        self._merge_devices_from_multiple_sources([refreshed_device_map for _, refreshed_device_map in refreshed_accounts])
+        device_list_changed = False
+        for (account, refreshed_device_map), new_device_ids in zip(refreshed_accounts, refreshed_device_ids):
+            device_map = account.device_manager.device_map
+            if device_map.keys() != refreshed_device_map.keys():
+                device_list_changed = True
+            #The entities hold the restored devices, update them in place instead of replacing them
+            for device_id, refreshed_device in refreshed_device_map.items():
+                if device := device_map.get(device_id, None):
+                    XTDevice.update_from_refreshed_device(device, refreshed_device)
+                else:
+                    device_map[device_id] = refreshed_device
+            for device_id in [device_id for device_id in device_map if device_id not in refreshed_device_map]:
+                device_map.pop(device_id)
+            account.device_ids.clear()
+            account.device_ids.extend(new_device_ids)
+        self.intern_device_specifications()
+        for device in list(self.device_map.values()):
+            self.multi_device_listener.update_device(device)
+        return device_list_changed
+
     def convert_tuya_devices_to_xt(self, manager):
         for dev_id in manager.device_map:
             manager.device_map[dev_id] = XTDevice.from_compatible_device(manager.device_map[dev_id])
@@ -316,40 +672,94 @@ class MultiManager:  # noqa: F811
             return_list.append(self.iot_account.device_manager.device_map)
         return return_list
 
-    def _merge_devices_from_multiple_sources(self):
-        #Merge the device function, status_range and status between managers
-        device_maps = self._get_available_device_maps()
-        aggregated_device_list = self.device_map
-        for device in aggregated_device_list.values():
+    def _merge_devices_from_multiple_sources(self, device_maps: list[dict[str, XTDevice]] | None = None):
+        #Merge the device function, status_range and status between managers,
+        #only the devices available in more than one source need to be merged.
+        #device_maps are maps that are not part of the index yet (see refresh_device_cache)
+        if device_maps is None:
+            aggregated_device_list, device_sources_map = self.device_map, self.device_sources_map
+        else:
+            aggregated_device_list, device_sources_map = self._get_device_sources(device_maps)
+        for devices in list(device_sources_map.values()):
+            if len(devices) < 2:
+                continue
             to_be_merged: list[XTDevice] = []
-            devices = self.get_devices_from_device_id(device.id)
             for current_device in devices:
                 for prev_device in to_be_merged:
                     self._merge_devices(current_device, prev_device)
                 to_be_merged.append(current_device)
-        for device_map in device_maps:
-            merge_iterables(device_map, aggregated_device_list)
+
+        #Make every device available in every manager
+        added_device_ids: set[str] = set()
+        for device_map in self._get_available_device_maps() if device_maps is None else device_maps:
+            if len(device_map) == len(aggregated_device_list):
+                continue
+            missing_devices: dict[str, XTDevice] = {
+                device_id: XTDevice.copy_device_with_shared_specs(device)
+                for device_id, device in list(aggregated_device_list.items())
+                if device_id not in device_map
+            }
+            #Bypass the notifications, only the index entries of the added devices are updated below
+            dict.update(device_map, missing_devices)
+            added_device_ids.update(missing_devices)
+        if device_maps is not None:
+            return
+        for device_id in added_device_ids:
+            self.on_device_map_updated(device_id)
         
     def _merge_devices(self, receiving_device: XTDevice, giving_device: XTDevice):
-        merge_iterables(receiving_device.status_range, giving_device.status_range)
-        merge_iterables(receiving_device.function, giving_device.function)
-        merge_iterables(receiving_device.status, giving_device.status)
+        #The status_range and function objects are copied on write (see XTDevice.set_specification_values)
+        #and the status values are replaced rather than modified, share them instead of copying them
+        merge_iterables(receiving_device.status_range, giving_device.status_range, deep_copy=False)
+        merge_iterables(receiving_device.function, giving_device.function, deep_copy=False)
+        merge_iterables(receiving_device.status, giving_device.status, deep_copy=False)
         if hasattr(receiving_device, "local_strategy") and hasattr(giving_device, "local_strategy"):
-            merge_iterables(receiving_device.local_strategy, giving_device.local_strategy)
+            #The entries are copied on write too (see XTDevice.set_local_strategy_config_value)
+            merge_iterables(receiving_device.local_strategy, giving_device.local_strategy, deep_copy=False)
+            XTDevice.rebuild_dp_code_index(receiving_device)
         if hasattr(receiving_device, "data_model") and hasattr(giving_device, "data_model"):
             if receiving_device.data_model == "" and giving_device.data_model != "":
-                receiving_device.data_model = copy.deepcopy(giving_device.data_model)
+                receiving_device.data_model = giving_device.data_model
             if giving_device.data_model == "" and receiving_device.data_model != "":
-                giving_device.data_model = copy.deepcopy(receiving_device.data_model)
+                giving_device.data_model = receiving_device.data_model
     
     def get_aggregated_device_map(self) -> dict[str, XTDevice]:
+        return self.aggregated_device_map
+
+    def rebuild_aggregated_device_map(self) -> None:
+        self.aggregated_device_map, self.device_sources_map = self._get_device_sources(self._get_available_device_maps())
+        self.device_map_version += 1
+
+    def _get_device_sources(self, device_maps: list[dict[str, XTDevice]]) -> tuple[dict[str, XTDevice], dict[str, tuple[XTDevice, ...]]]:
         aggregated_list: dict[str, XTDevice] = {}
-        device_maps = self._get_available_device_maps()
+        device_sources: dict[str, list[XTDevice]] = {}
         for device_map in device_maps:
             for device_id in device_map:
                 if device_id not in aggregated_list:
                     aggregated_list[device_id] = device_map[device_id]
-        return aggregated_list
+                    device_sources[device_id] = []
+                device_sources[device_id].append(device_map[device_id])
+        return aggregated_list, {device_id: tuple(devices) for device_id, devices in device_sources.items()}
+
+    def on_device_map_updated(self, device_id: str | None) -> None:
+        #Called by the managers' device maps when a device is added or removed,
+        #only the entries of that device are updated (the readers iterate over copies)
+        if device_id is None:
+            self.rebuild_aggregated_device_map()
+            return
+        devices = tuple(
+            device_map[device_id]
+            for device_map in self._get_available_device_maps()
+            if device_id in device_map
+        )
+        if devices:
+            self.aggregated_device_map[device_id] = devices[0]
+            self.device_sources_map[device_id] = devices
+        else:
+            self.aggregated_device_map.pop(device_id, None)
+            self.device_sources_map.pop(device_id, None)
+            self.multi_source_handler.remove_device(device_id)
+        self.device_map_version += 1
     
     def unload(self):
         if self.sharing_account and not self.iot_account:
@@ -419,37 +829,65 @@ class MultiManager:  # noqa: F811
                     descriptors_with_vf[category] = tuple(description_list_vf)
         if len(descriptors_with_vs) > 0:
             self.descriptors_with_virtual_state[name] = descriptors_with_vs
-            for device_id in self.device_map:
+            self._compile_category_virtual_states()
+            for device_id in list(self.device_map):
                 devices = self.get_devices_from_device_id(device_id)
                 for device in devices:
                     self.apply_init_virtual_states(device)
 
         if len(descriptors_with_vf) > 0:
             self.descriptors_with_virtual_function[name] = descriptors_with_vf
+            self._compile_category_virtual_functions()
 
-    def get_category_virtual_states(self,category: str) -> list[DescriptionVirtualState]:
-        to_return = []
+    def _compile_category_virtual_states(self) -> None:
+        #Precompute the virtual states of every category once, they only change when descriptors are registered
+        category_virtual_states: dict[str, list[DescriptionVirtualState]] = {}
         for virtual_state in VirtualStates:
             for descriptor in self.descriptors_with_virtual_state.values():
-                if (descriptions := descriptor.get(category)):
+                for category, descriptions in descriptor.items():
                     for description in descriptions:
                         if description.virtual_state is not None and description.virtual_state & virtual_state.value:
                             # This virtual_state is applied to this key, let's return it
                             found_virtual_state = DescriptionVirtualState(description.key, virtual_state.name, virtual_state.value, description.vs_copy_to_state, description.vs_copy_delta_to_state)
-                            to_return.append(found_virtual_state)
-        return to_return
-    
-    def get_category_virtual_functions(self,category: str) -> list[DescriptionVirtualFunction]:
-        to_return = []
+                            category_virtual_states.setdefault(category, []).append(found_virtual_state)
+        self.category_virtual_states = {
+            category: tuple(virtual_states) for category, virtual_states in category_virtual_states.items()
+        }
+        self.category_virtual_state_keys = {
+            category: frozenset(virtual_state.key for virtual_state in virtual_states)
+            for category, virtual_states in category_virtual_states.items()
+        }
+
+    def _compile_category_virtual_functions(self) -> None:
+        #Precompute the virtual functions of every category once, they only change when descriptors are registered
+        category_virtual_functions: dict[str, list[DescriptionVirtualFunction]] = {}
         for virtual_function in VirtualFunctions:
             for descriptor in self.descriptors_with_virtual_function.values():
-                if (descriptions := descriptor.get(category)):
+                for category, descriptions in descriptor.items():
                     for description in descriptions:
                         if description.virtual_function is not None and description.virtual_function & virtual_function.value:
                             # This virtual_state is applied to this key, let's return it
                             found_virtual_function = DescriptionVirtualFunction(description.key, virtual_function.name, virtual_function.value, description.vf_reset_state)
-                            to_return.append(found_virtual_function)
-        return to_return
+                            category_virtual_functions.setdefault(category, []).append(found_virtual_function)
+        self.category_virtual_functions = {
+            category: tuple(virtual_functions) for category, virtual_functions in category_virtual_functions.items()
+        }
+
+    def get_category_virtual_states(self,category: str) -> tuple[DescriptionVirtualState, ...]:
+        return self.category_virtual_states.get(category, ())
+    
+    def get_category_virtual_state_keys(self, category: str) -> frozenset[str]:
+        return self.category_virtual_state_keys.get(category, frozenset())
+
+    def get_category_virtual_functions(self,category: str) -> tuple[DescriptionVirtualFunction, ...]:
+        return self.category_virtual_functions.get(category, ())
+
+    def get_device_command_routes(self, device: XTDevice) -> XTDeviceCommandRoutes:
+        return XTDevice.get_command_routes(device, self.get_category_virtual_functions(device.category))
+
+    def build_device_command_routes(self) -> None:
+        for device in list(self.get_aggregated_device_map().values()):
+            self.get_device_command_routes(device)
     
     def remove_device_listeners(self) -> None:
         if self.iot_account:
@@ -467,30 +905,19 @@ class MultiManager:  # noqa: F811
     def _read_dpId_from_code(self, code: str, device: XTDevice) -> int | None:
         if not hasattr(device, "local_strategy"):
             return None
-        for dpId in device.local_strategy:
-            if device.local_strategy[dpId]["status_code"] == code:
-                return dpId
-        return None
+        return XTDevice.get_dp_code_index(device).code_to_dp_id.get(code, None)
     
     def _read_code_from_dpId(self, dpId: int, device: XTDevice) -> str | None:
-        if dp_id_item := device.local_strategy.get(dpId, None):
-            return dp_id_item["status_code"]
-        return None
+        return XTDevice.get_dp_code_index(device).dp_id_to_code.get(dpId, None)
     
-    def _get_empty_local_strategy_dp_id(self, device: XTDevice) -> int | None:
-        if not hasattr(device, "local_strategy"):
-            return None
-        base_id = 10000
-        while True:
-            if base_id in device.local_strategy:
-                base_id += 1
-                continue
-            return base_id
-
     def apply_init_virtual_states(self, device: XTDevice):
         #WARNING, this method might be called multiple times for the same device, make sure it doesn't
         #fail upon multiple successive calls
         virtual_states = self.get_category_virtual_states(device.category)
+        applied_virtual_states: XTVirtualStatesApplication | None = getattr(device, "applied_virtual_states", None)
+        if applied_virtual_states is not None and applied_virtual_states.is_up_to_date(device, virtual_states):
+            #Nothing changed since the virtual states were last applied to this device
+            return
         for virtual_state in virtual_states:
             if virtual_state.virtual_state_value == VirtualStates.STATE_COPY_TO_MULTIPLE_STATE_NAME:
                 if virtual_state.key in device.status:
@@ -499,83 +926,75 @@ class MultiManager:  # noqa: F811
                             new_code = str(vs_new_code)
                             if device.status.get(new_code, None) is None:
                                 device.status[new_code] = copy.deepcopy(device.status[virtual_state.key])
-                            device.status_range[new_code] = copy.deepcopy(device.status_range[virtual_state.key])
-                            device.status_range[new_code].code = new_code
-                            if not self._read_dpId_from_code(new_code, device):
-                                if dp_id := self._read_dpId_from_code(virtual_state.key, device):
-                                    if new_dp_id := self._get_empty_local_strategy_dp_id(device):
-                                        new_local_strategy = copy.deepcopy(device.local_strategy[dp_id])
-                                        if "config_item" in new_local_strategy:
-                                            new_local_strategy_config_item = new_local_strategy["config_item"]
-                                            if "statusFormat" in new_local_strategy_config_item and virtual_state.key in new_local_strategy_config_item["statusFormat"]:
-                                                new_local_strategy_config_item["statusFormat"] = new_local_strategy_config_item["statusFormat"].replace(virtual_state.key, new_code)
-                                        new_local_strategy["status_code"] = new_code
-                                        device.local_strategy[new_dp_id] = new_local_strategy
+                            device.status_range[new_code] = self.device_specification_pool.get_specification_clone(device.status_range[virtual_state.key], new_code)
+                            self._add_virtual_state_dp_id(device, virtual_state.key, new_code, True)
                         for vs_new_code in virtual_state.vs_copy_delta_to_state:
                             new_code = str(vs_new_code)
                             if device.status.get(new_code, None) is None:
                                 device.status[new_code] = 0
-                            device.status_range[new_code] = copy.deepcopy(device.status_range[virtual_state.key])
-                            device.status_range[new_code].code = new_code
-                            if not self._read_dpId_from_code(new_code, device):
-                                if dp_id := self._read_dpId_from_code(virtual_state.key, device):
-                                    if new_dp_id := self._get_empty_local_strategy_dp_id(device):
-                                        new_local_strategy = copy.deepcopy(device.local_strategy[dp_id])
-                                        if "config_item" in new_local_strategy:
-                                            new_local_strategy_config_item = new_local_strategy["config_item"]
-                                            if "statusFormat" in new_local_strategy_config_item and virtual_state.key in new_local_strategy_config_item["statusFormat"]:
-                                                new_local_strategy_config_item["statusFormat"] = new_local_strategy_config_item["statusFormat"].replace(virtual_state.key, new_code)
-                                        new_local_strategy["status_code"] = new_code
-                                        device.local_strategy[new_dp_id] = new_local_strategy
+                            device.status_range[new_code] = self.device_specification_pool.get_specification_clone(device.status_range[virtual_state.key], new_code)
+                            self._add_virtual_state_dp_id(device, virtual_state.key, new_code, True)
                     if virtual_state.key in device.function:
                         for vs_new_code in virtual_state.vs_copy_to_state:
                             new_code = str(vs_new_code)
                             if device.status.get(new_code, None) is None:
                                 device.status[new_code] = copy.deepcopy(device.status[virtual_state.key])
-                            device.function[new_code] = copy.deepcopy(device.function[virtual_state.key])
-                            device.function[new_code].code = new_code
-                            if not self._read_dpId_from_code(new_code, device):
-                                if dp_id := self._read_dpId_from_code(virtual_state.key, device):
-                                    if new_dp_id := self._get_empty_local_strategy_dp_id(device):
-                                        new_local_strategy = copy.deepcopy(device.local_strategy[dp_id])
-                                        new_local_strategy["status_code"] = new_code
-                                        device.local_strategy[new_dp_id] = new_local_strategy
-
-    def apply_virtual_states_to_status_list(self, device: XTDevice, status_in: list) -> list:
-        status = copy.deepcopy(status_in)
-        virtual_states = self.get_category_virtual_states(device.category)
+                            device.function[new_code] = self.device_specification_pool.get_specification_clone(device.function[virtual_state.key], new_code)
+                            self._add_virtual_state_dp_id(device, virtual_state.key, new_code, False)
+        if virtual_states:
+            #Share the copied specifications with the other devices of the product
+            self.device_specification_pool.intern_device(device)
+        self.get_device_command_routes(device)
+        device.applied_virtual_states = XTVirtualStatesApplication(device, virtual_states)
+
+    def _add_virtual_state_dp_id(self, device: XTDevice, source_code: str, new_code: str, rename_status_format: bool) -> None:
+        if not hasattr(device, "local_strategy"):
+            return
+        dp_code_index = XTDevice.get_dp_code_index(device)
+        if (dp_id := dp_code_index.code_to_dp_id.get(source_code, None)) is None:
+            return
+        new_dp_id = dp_code_index.code_to_dp_id.get(new_code, None)
+        if new_dp_id is not None and new_dp_id < VIRTUAL_DP_ID_BASE:
+            #The code is a real DP of the device
+            return
+        clone = self.device_specification_pool.get_local_strategy_clone(device.local_strategy[dp_id], source_code, new_code, rename_status_format)
+        if new_dp_id is not None:
+            #Already added, refresh it in case the source entry was replaced since
+            if device.local_strategy[new_dp_id] is not clone:
+                device.local_strategy[new_dp_id] = clone
+                device.command_routes = None
+            return
+        new_dp_id = dp_code_index.get_free_dp_id()
+        device.local_strategy[new_dp_id] = clone
+        dp_code_index.add_dp_id(new_dp_id, new_code)
+
+    def _apply_virtual_states_to_status_list(self, device: XTDevice, status: list, virtual_states: tuple[DescriptionVirtualState, ...]) -> None:
+        #Works in place on a status list owned by the caller whose items already have their code and dpId resolved
         for virtual_state in virtual_states:
             if virtual_state.virtual_state_value == VirtualStates.STATE_COPY_TO_MULTIPLE_STATE_NAME:
+                #Items appended here are also visited so that copies can be chained (add_ele -> add_ele2 -> ...)
                 for item in status:
-                    code, dpId, new_key_value, result_ok = self._read_code_dpid_value_from_state(device.id, item)
-                    if result_ok and code == virtual_state.key:
-                        cur_key_value = 0
-                        if code in device.status:
-                            cur_key_value = device.status[code]
-                        for state_name in virtual_state.vs_copy_to_state:
-                            code, dpId, new_key_value, result_ok = self._read_code_dpid_value_from_state(device.id, {"code": str(state_name), "value": new_key_value})
-                            if result_ok:
-                                new_status = {"code": code, "value": copy.copy(new_key_value), "dpId": dpId}
-                                status.append(new_status)
-                        for state_name in virtual_state.vs_copy_delta_to_state:
-                            code, dpId, new_key_value, result_ok = self._read_code_dpid_value_from_state(device.id, {"code": str(state_name), "value": new_key_value})
-                            current_value = None
-                            if code in device.status:
-                                current_value = device.status[code]
-                            if result_ok and current_value is not None:
-                                new_status = {"code": code, "value": copy.copy(new_key_value - cur_key_value), "dpId": dpId}
-                                status.append(new_status)
+                    if item.get("code", None) != virtual_state.key or item.get("dpId", None) is None:
+                        continue
+                    new_key_value = item.get("value", None)
+                    cur_key_value = device.status.get(virtual_state.key, 0)
+                    for state_name in virtual_state.vs_copy_to_state:
+                        code = str(state_name)
+                        if (dpId := self._read_dpId_from_code_for_device_id(device.id, code)) is not None:
+                            status.append({"code": code, "value": new_key_value, "dpId": dpId})
+                    for state_name in virtual_state.vs_copy_delta_to_state:
+                        code = str(state_name)
+                        if device.status.get(code, None) is None:
+                            continue
+                        if (dpId := self._read_dpId_from_code_for_device_id(device.id, code)) is not None:
+                            status.append({"code": code, "value": new_key_value - cur_key_value, "dpId": dpId})
             
             if virtual_state.virtual_state_value == VirtualStates.STATE_SUMMED_IN_REPORTING_PAYLOAD:
-                if virtual_state.key not in device.status or device.status[virtual_state.key] is None:
+                if device.status.get(virtual_state.key, None) is None:
                     device.status[virtual_state.key] = 0
-                if virtual_state.key in device.status:
-                    for item in status:
-                        code, dpId, new_key_value, result_ok = self._read_code_dpid_value_from_state(device.id, item, False, True)
-                        if result_ok and code == virtual_state.key:
-                            item["value"] += device.status[virtual_state.key]
-                            continue
-        return status
+                for item in status:
+                    if item.get("code", None) == virtual_state.key:
+                        item["value"] += device.status[virtual_state.key]
 
     def allow_virtual_devices_not_set_up(self, device: XTDevice):
         if not device.id.startswith("vdevo"):
@@ -583,13 +1002,8 @@ class MultiManager:  # noqa: F811
         if not getattr(device, "set_up", True):
             setattr(device, "set_up", True)
     
-    def get_devices_from_device_id(self, device_id: str) -> list[XTDevice] | None:
-        return_list = []
-        device_maps = self._get_available_device_maps()
-        for device_map in device_maps:
-            if device_id in device_map:
-                return_list.append(device_map[device_id])
-        return return_list
+    def get_devices_from_device_id(self, device_id: str) -> tuple[XTDevice, ...]:
+        return self.device_sources_map.get(device_id, ())
 
     def _read_code_dpid_value_from_state(self, device_id: str, state, fail_if_dpid_not_found = True, fail_if_code_not_found = True):
         devices = self.get_devices_from_device_id(device_id)
@@ -628,16 +1042,36 @@ class MultiManager:  # noqa: F811
             return None, None, None, False
         return code, dpId, value, True
 
-    def convert_device_report_status_list(self, device_id: str, status_in: list) -> list:
-        status = copy.deepcopy(status_in)
-        for item in status:
-            code, dpId, value, result_ok = self._read_code_dpid_value_from_state(device_id, item)
-            if result_ok:
-                item["code"] = code
-                item["dpId"] = dpId
-                item["value"] = value
+    def _read_dpId_from_code_for_device_id(self, device_id: str, code: str) -> int | None:
+        for device in self.get_devices_from_device_id(device_id):
+            if (dpId := self._read_dpId_from_code(code, device)) is not None:
+                return dpId
+        return None
+
+    def convert_device_report_status_list(self, device: XTDevice, source: str, status_in: list) -> list:
+        #Single pass over the report: resolve code and dpId, drop the items coming from a source
+        #that is not allowed for their code and apply the virtual states.
+        #The incoming list is left untouched, only the returned list and its items are allocated.
+        virtual_states = self.get_category_virtual_states(device.category)
+        virtual_state_keys = self.category_virtual_state_keys.get(device.category, ())
+        status: list[dict[str, Any]] = []
+        for item in status_in:
+            code, dpId, value, result_ok = self._read_code_dpid_value_from_state(device.id, item, False, True)
+            new_item = dict(item)
+            if result_ok and dpId is not None:
+                new_item["code"] = code
+                new_item["dpId"] = dpId
+                new_item["value"] = value
             else:
-                LOGGER.warning(f"convert_device_report_status_list code retrieval failed => {item} <=>{device_id}")
+                LOGGER.warning(f"convert_device_report_status_list code retrieval failed => {item} <=>{device.id}")
+            if (
+                code in virtual_state_keys
+                and not self.multi_source_handler.is_allowed_source_for_code(device.id, code, source)
+            ):
+                continue
+            status.append(new_item)
+        if virtual_states:
+            self._apply_virtual_states_to_status_list(device, status, virtual_states)
         return status
 
     def on_message_from_tuya_iot(self, msg:str):
@@ -647,6 +1081,9 @@ class MultiManager:  # noqa: F811
         self.on_message(MESSAGE_SOURCE_TUYA_SHARING, msg)
 
     def on_message(self, source: str, msg: str):
+        self.multi_mqtt_queue.put_message(source, msg)
+
+    def process_message(self, source: str, msg: str):
         dev_id = self._get_device_id_from_message(msg)
         if not dev_id:
             LOGGER.warning(f"dev_id {dev_id} not found!")
@@ -654,6 +1091,11 @@ class MultiManager:  # noqa: F811
         
         new_message = self._convert_message_for_all_accounts(msg)
         if status_list := self._get_status_list_from_message(msg):
+            status_list = self.multi_source_handler.filter_duplicate_status_list(dev_id, status_list)
+            if not status_list:
+                #Already received from the other account
+                return
+            new_message["data"]["status"] = status_list
             self.multi_source_handler.register_status_list_from_source(dev_id, source, status_list)
         
         if self.sharing_account and source == MESSAGE_SOURCE_TUYA_SHARING:
@@ -705,6 +1147,32 @@ class MultiManager:  # noqa: F811
 
     def send_commands(
             self, device_id: str, commands: list[dict[str, Any]]
+    ):
+        #Virtual functions are handled locally, they don't wait for the other commands
+        virtual_function_commands, device_commands = self._split_virtual_function_commands(device_id, commands)
+        if virtual_function_commands:
+            self.send_commands_now(device_id, virtual_function_commands)
+        if device_commands:
+            self.command_coalescer.send_commands(device_id, device_commands)
+
+    def _split_virtual_function_commands(
+            self, device_id: str, commands: list[dict[str, Any]]
+    ) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        if (device := self.get_aggregated_device_map().get(device_id, None)) is None:
+            return [], commands
+        command_routes = self.get_device_command_routes(device)
+        virtual_function_commands: list[dict[str, Any]] = []
+        device_commands: list[dict[str, Any]] = []
+        for command in commands:
+            route = command_routes.get_route(command["code"])
+            if route is not None and route.backend == XTCommandBackend.VIRTUAL_FUNCTION:
+                virtual_function_commands.append(command)
+            else:
+                device_commands.append(command)
+        return virtual_function_commands, device_commands
+
+    def send_commands_now(
+            self, device_id: str, commands: list[dict[str, Any]]
     ):
         open_api_regular_commands: list[dict[str, Any]] = []
         regular_commands: list[dict[str, Any]] = []
@@ -712,36 +1180,25 @@ class MultiManager:  # noqa: F811
         virtual_function_commands: list[dict[str, Any]] = []
         device_map = self.get_aggregated_device_map()
         if device := device_map.get(device_id, None):
-            virtual_function_list = self.get_category_virtual_functions(device.category)
+            command_routes = self.get_device_command_routes(device)
             for command in commands:
                 command_code  = command["code"]
                 command_value = command["value"]
                 LOGGER.debug(f"Base command : {command}")
-                vf_found = False
-                for virtual_function in virtual_function_list:
-                    if (command_code == virtual_function.key or
-                        command_code in virtual_function.vf_reset_state):
-                        command_dict = {"code": command_code, "value": command_value, "virtual_function": virtual_function}
-                        virtual_function_commands.append(command_dict)
-                        vf_found = True
-                        break
-                if vf_found:
+                if (route := command_routes.get_route(command_code)) is None:
                     continue
-                for dp_item in device.local_strategy.values():
-                    dp_item_code = dp_item.get("status_code", None)
-                    if command_code == dp_item_code:
-                        if not dp_item.get("use_open_api", False):
-                            #command_dict = {"code": code, "value": value}
-                            regular_commands.append(command)
-                        else:
-                            if dp_item.get("property_update", False):
-                                command_value = prepare_value_for_property_update(dp_item, command_value)
-                                property_dict = {str(dp_item_code): command_value}
-                                property_commands.append(property_dict)
-                            else:
-                                command_dict = {"code": dp_item_code, "value": command_value}
-                                open_api_regular_commands.append(command_dict)
-                            break
+                if route.backend == XTCommandBackend.VIRTUAL_FUNCTION:
+                    command_dict = {"code": command_code, "value": command_value, "virtual_function": route.virtual_function}
+                    virtual_function_commands.append(command_dict)
+                elif route.backend == XTCommandBackend.SHARING:
+                    #command_dict = {"code": code, "value": value}
+                    regular_commands.append(command)
+                elif route.backend == XTCommandBackend.IOT_PROPERTY:
+                    property_dict = {str(command_code): route.encode_value(command_value)}
+                    property_commands.append(property_dict)
+                else:
+                    command_dict = {"code": command_code, "value": command_value}
+                    open_api_regular_commands.append(command_dict)
             if virtual_function_commands:
                 LOGGER.debug(f"Sending virtual function command : {virtual_function_commands}")
                 self._process_virtual_function(device_id, virtual_function_commands)
@@ -0,0 +1,60 @@
+"""
+Non blocking HTTP transport shared by the cloud accounts of an entry.
+
+Requests go through Home Assistant's aiohttp session, whose connection pool
+keeps the connections to the Tuya cloud alive between requests, and are run on
+the event loop so that they don't hold an executor thread while waiting for
+the cloud. The number of requests in flight to a same host is limited.
+"""
+
+from __future__ import annotations
+import asyncio
+from typing import Any
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from ...const import (
+    LOGGER,
+    HTTP_MAX_HOST_CONCURRENCY,
+    IOT_REQUEST_TIMEOUT,
+)
+
+class XTAsyncHTTPClient:
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        max_host_concurrency: int = HTTP_MAX_HOST_CONCURRENCY,
+        request_timeout: float = IOT_REQUEST_TIMEOUT,
+    ) -> None:
+        self.hass = hass
+        self.max_host_concurrency = max(1, max_host_concurrency)
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    async def async_request_json(
+        self,
+        method: str,
+        url: str,
+        params: dict[str, Any] | None = None,
+        data: str | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> dict[str, Any] | None:
+        """Send a request and return its decoded JSON body, None if the request failed."""
+        async with self._get_host_semaphore(url):
+            async with async_get_clientsession(self.hass).request(
+                method, url, params=params, data=data, headers=headers, timeout=self.timeout
+            ) as response:
+                if not response.ok:
+                    LOGGER.error(f"Response error: code={response.status}, body={await response.text()}")
+                    return None
+                return await response.json(content_type=None)
+
+    def _get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.max_host_concurrency)
+        return self.host_semaphores[host]
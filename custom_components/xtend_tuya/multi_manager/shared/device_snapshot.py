@@ -0,0 +1,84 @@
+"""
+Snapshot of the merged device cache used to warm start the integration.
+
+The devices (specifications, local_strategy, data_model and last status) are
+stored in Home Assistant's .storage so that the entities can be created right
+away on the next startup while the cloud refresh runs in the background.
+"""
+
+from __future__ import annotations
+from datetime import timedelta
+from typing import Any, Callable
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+
+from ...const import (
+    DOMAIN,
+)
+
+DEVICE_SNAPSHOT_VERSION = 1
+DEVICE_SNAPSHOT_SAVE_DELAY = 60
+DEVICE_SNAPSHOT_SAVE_INTERVAL = timedelta(hours=1)
+
+#Attributes rebuilt at runtime that must not be restored
+DEVICE_SNAPSHOT_EXCLUDED_ATTRIBUTES = {"function", "status_range", "local_strategy", "status", "dp_code_index", "command_routes", "applied_virtual_states", "set_up"}
+
+class XTDeviceSnapshot:
+    def __init__(self, hass: HomeAssistant, entry_id: str, data_to_save: Callable[[], dict[str, Any]]) -> None:
+        self.hass = hass
+        self.store: Store[dict[str, Any]] = Store(hass, DEVICE_SNAPSHOT_VERSION, XTDeviceSnapshot.get_storage_key(entry_id))
+        self.data_to_save = data_to_save
+
+    @staticmethod
+    def get_storage_key(entry_id: str) -> str:
+        return f"{DOMAIN}.{entry_id}.device_snapshot"
+
+    @staticmethod
+    async def async_remove(hass: HomeAssistant, entry_id: str) -> None:
+        await Store(hass, DEVICE_SNAPSHOT_VERSION, XTDeviceSnapshot.get_storage_key(entry_id)).async_remove()
+
+    async def async_load(self) -> dict[str, Any] | None:
+        return await self.store.async_load()
+
+    async def async_save(self) -> None:
+        await self.store.async_save(self.data_to_save())
+
+    @callback
+    def async_schedule_save(self) -> None:
+        self.store.async_delay_save(self.data_to_save, DEVICE_SNAPSHOT_SAVE_DELAY)
+
+    @callback
+    def async_track_saves(self, entry: ConfigEntry) -> None:
+        #Save periodically and when Home Assistant stops, the config entries are not unloaded on stop
+        @callback
+        def async_schedule_save(_: Any) -> None:
+            self.async_schedule_save()
+        entry.async_on_unload(async_track_time_interval(self.hass, async_schedule_save, DEVICE_SNAPSHOT_SAVE_INTERVAL))
+        entry.async_on_unload(self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_schedule_save))
+
+    @staticmethod
+    def serialize_device(device) -> dict[str, Any]:
+        #The status is copied since the MQTT threads can update it while the snapshot is written
+        device_data = {key: value for key, value in vars(device).items() if key not in DEVICE_SNAPSHOT_EXCLUDED_ATTRIBUTES}
+        device_data["status"] = dict(getattr(device, "status", {}))
+        device_data["local_strategy"] = dict(getattr(device, "local_strategy", {}))
+        device_data["function"] = {code: vars(function) for code, function in getattr(device, "function", {}).items()}
+        device_data["status_range"] = {code: vars(status_range) for code, status_range in getattr(device, "status_range", {}).items()}
+        return device_data
+
+    @staticmethod
+    def deserialize_device(device_data: dict[str, Any], device_class: type, function_class: type, status_range_class: type):
+        device_data = dict(device_data)
+        function = device_data.pop("function", {})
+        status_range = device_data.pop("status_range", {})
+        local_strategy = device_data.pop("local_strategy", {})
+        device = device_class(**device_data)
+        device.function = {code: function_class(**function_data) for code, function_data in function.items()}
+        device.status_range = {code: status_range_class(**status_range_data) for code, status_range_data in status_range.items()}
+        #JSON turned the dpIds into strings
+        device.local_strategy = {int(dp_id): dp_item for dp_id, dp_item in local_strategy.items()}
+        return device
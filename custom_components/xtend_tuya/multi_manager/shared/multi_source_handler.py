@@ -1,64 +1,102 @@
 from __future__ import annotations
-import copy
+import time
+from typing import Any
 
 from ..multi_manager import MultiManager
-from ...const import LOGGER
+from ...const import (
+    LOGGER,
+    MESSAGE_SOURCE_TUYA_IOT,
+    MESSAGE_SOURCE_TUYA_SHARING,
+    REPORT_DEDUPLICATION_WINDOW,
+)
 
-class SourceCodeCounter:
-    def __init__(self, source: str) -> None:
-        self.source = source
-        self.counter = 1
+#Fixed index of each source in the counters of a code
+MULTI_SOURCES: tuple[str, ...] = (MESSAGE_SOURCE_TUYA_SHARING, MESSAGE_SOURCE_TUYA_IOT)
+MULTI_SOURCE_INDEXES: dict[str, int] = {source: index for index, source in enumerate(MULTI_SOURCES)}
+#When a counter reaches this value all the counters of the code are halved
+MULTI_SOURCE_COUNTER_DECAY_THRESHOLD = 1024
 
 class MultiSourceCodeCounter:
+    __slots__ = ("counters", "allowed_source_index")
+
     def __init__(self) -> None:
-        self.source_counter_list: list[SourceCodeCounter] = []
-        self.last_allowed_source = None
+        self.counters: list[int] = [0] * len(MULTI_SOURCES)
+        self.allowed_source_index: int | None = None
     
     def register_source_message(self, source: str):
-        source_counter_found = False
-        for source_counter in self.source_counter_list:
-            if source_counter.source == source:
-                source_counter.counter += 1
-                source_counter_found = True
-                break
-        
-        if not source_counter_found:
-            self.source_counter_list.append(SourceCodeCounter(source))
+        if (source_index := MULTI_SOURCE_INDEXES.get(source, None)) is None:
+            return
+        counters = self.counters
+        counters[source_index] += 1
+        if counters[source_index] >= MULTI_SOURCE_COUNTER_DECAY_THRESHOLD:
+            #Keep the counters bounded and the arbitration following the recent messages
+            for index in range(len(counters)):
+                counters[index] //= 2
+        #Only switch to another source once it is ahead by more than one message
+        if self.allowed_source_index is None:
+            self.allowed_source_index = source_index
+        elif counters[source_index] - counters[self.allowed_source_index] > 1:
+            self.allowed_source_index = source_index
     
-    def get_allowed_source(self) -> str:
-        last_allowed_source_count = 0
-        highest_source_count = 0
-        highest_source = None
-        for source_counter in self.source_counter_list:
-            if source_counter.source == self.last_allowed_source:
-                last_allowed_source_count = source_counter.counter
-            if source_counter.counter > highest_source_count:
-                highest_source_count = source_counter.counter
-                highest_source = source_counter.source
-
-        if self.last_allowed_source is None:
-            self.last_allowed_source = highest_source
-            return highest_source
-        
-        if ( highest_source_count - last_allowed_source_count ) > 1:
-            self.last_allowed_source = highest_source
-            return highest_source
-        else:
-            return self.last_allowed_source
+    def get_allowed_source(self) -> str | None:
+        if self.allowed_source_index is None:
+            return None
+        return MULTI_SOURCES[self.allowed_source_index]
 
 
 class MultiSourceHandler:
     def __init__(self, multi_manager: MultiManager) -> None:
         self.multi_manager = multi_manager
         self.device_map: dict[str, dict[str, MultiSourceCodeCounter]] = {}
+        #(dev_id, code, value, t) => expiration time, in insertion (hence expiration) order
+        self.received_reports: dict[tuple, float] = {}
+
+    def filter_duplicate_status_list(self, dev_id: str, status_in: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        #Drop the report items already received from any account, the messages are processed by a single consumer
+        devices = self.multi_manager.get_devices_from_device_id(dev_id)
+        if not devices:
+            return status_in
+        now = time.monotonic()
+        self._expire_received_reports(now)
+        virtual_state_keys = self.multi_manager.get_category_virtual_state_keys(devices[0].category)
+        status_out: list[dict[str, Any]] = []
+        for item in status_in:
+            if (report_time := item.get("t", None)) is None:
+                status_out.append(item)
+                continue
+            code, dpId, value, result_ok = self.multi_manager._read_code_dpid_value_from_state(dev_id, item, False, False)
+            if not result_ok or code is None or code in virtual_state_keys:
+                #Virtual states rely on the source arbitration to pick a single account
+                status_out.append(item)
+                continue
+            report_key = (dev_id, code, value, report_time)
+            try:
+                if report_key in self.received_reports:
+                    continue
+            except TypeError:
+                #Unhashable value (ie: JSON object)
+                status_out.append(item)
+                continue
+            self.received_reports[report_key] = now + REPORT_DEDUPLICATION_WINDOW
+            status_out.append(item)
+        return status_out
+
+    def _expire_received_reports(self, now: float) -> None:
+        expired_report_keys: list[tuple] = []
+        for report_key, expiration_time in self.received_reports.items():
+            if expiration_time > now:
+                break
+            expired_report_keys.append(report_key)
+        for report_key in expired_report_keys:
+            del self.received_reports[report_key]
     
     def register_status_list_from_source(self, dev_id: str, source: str, status_in) -> None:
         devices = self.multi_manager.get_devices_from_device_id(dev_id)
         if not devices:
             return
         
-        virtual_states = self.multi_manager.get_category_virtual_states(devices[0].category)
-        if not virtual_states:
+        virtual_state_keys = self.multi_manager.get_category_virtual_state_keys(devices[0].category)
+        if not virtual_state_keys:
             return
         
         for item in status_in:
@@ -66,44 +104,22 @@ class MultiSourceHandler:
             if not result_ok:
                 continue
 
-            for virtual_state in virtual_states:
-                if code == virtual_state.key:
-                    self._prepare_structure_for_code(dev_id, code)
-                    self.device_map[dev_id][code].register_source_message(source)
+            if code in virtual_state_keys:
+                self._get_code_counter(dev_id, code).register_source_message(source)
 
-    def filter_status_list(self, dev_id: str, original_source: str, status_in) -> str:
-        status_list = copy.deepcopy(status_in)
-        devices = self.multi_manager.get_devices_from_device_id(dev_id)
-        if not devices:
-            return status_list
-        
-        #Only filter for devices that have a VirtualState in their status_list
-        virtual_states = self.multi_manager.get_category_virtual_states(devices[0].category)
-        if not virtual_states:
-            return status_list
-        
-        i = 0
-        for item in status_list:
-            code, dpId, value, result_ok = self.multi_manager._read_code_dpid_value_from_state(dev_id, item, False, True)
-            if not result_ok:
-                continue
+    def _get_code_counter(self, dev_id: str, code: str) -> MultiSourceCodeCounter:
+        device_counters = self.device_map.get(dev_id, None)
+        if device_counters is None:
+            device_counters = self.device_map[dev_id] = {}
+        code_counter = device_counters.get(code, None)
+        if code_counter is None:
+            code_counter = device_counters[code] = MultiSourceCodeCounter()
+        return code_counter
 
-            for virtual_state in virtual_states:
-                if code == virtual_state.key:
-                    self._prepare_structure_for_code(dev_id, code)
-                    if not self._is_allowed_source_for_code(dev_id, code, original_source):
-                        status_list.pop(i)
-                        i -= 1
-                        break
-            i += 1
-        
-        return status_list
-    
-    def _prepare_structure_for_code(self, dev_id:str, code: str) -> None:
-        if dev_id not in self.device_map:
-            self.device_map[dev_id] = {}
-        if code not in self.device_map[dev_id]:
-            self.device_map[dev_id][code] = MultiSourceCodeCounter()
+    def is_allowed_source_for_code(self, dev_id: str, code: str, source: str) -> bool:
+        if (code_counter := self.device_map.get(dev_id, {}).get(code, None)) is None:
+            return False
+        return code_counter.get_allowed_source() == source
 
-    def _is_allowed_source_for_code(self, dev_id: str, code: str, source: str) -> bool:
-        return self.device_map[dev_id][code].get_allowed_source() == source
\ No newline at end of file
+    def remove_device(self, dev_id: str) -> None:
+        self.device_map.pop(dev_id, None)
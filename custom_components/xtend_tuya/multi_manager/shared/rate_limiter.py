@@ -0,0 +1,184 @@
+"""
+Rate limiter of the requests sent to the Tuya cloud.
+
+Each account has a token bucket for all its requests and one per request
+family (device specifications, properties, commands), the request must get a
+token from both. When a bucket is empty, the waiting commands are served
+before the background refreshes. When Tuya answers that the requests are too
+frequent, the budget of the buckets is reduced and they pause for an
+increasing delay, the budget is then restored progressively.
+"""
+
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from enum import IntEnum, StrEnum
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+
+from ...const import (
+    LOGGER,
+)
+
+RATE_LIMIT_MIN_RATE_RATIO = 0.1         #The budget of a bucket is never reduced under this ratio of its base budget
+RATE_LIMIT_RECOVERY_RATIO = 0.05        #Ratio of the base budget restored after each successful request
+RATE_LIMIT_INITIAL_BACKOFF = 1          #Pause (in seconds) after the first rate limit error, doubled on each consecutive error
+RATE_LIMIT_MAX_BACKOFF = 60             #Maximum pause (in seconds) after a rate limit error
+
+#Messages of the responses Tuya sends when the requests are too frequent
+RATE_LIMIT_ERROR_MESSAGES = ("frequen", "too many", "rate limit")
+
+class XTRequestFamily(StrEnum):
+    ACCOUNT = "account"
+    SPECIFICATION = "specification"
+    PROPERTIES = "properties"
+    COMMANDS = "commands"
+    OTHER = "other"
+
+class XTRequestPriority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+#Budget of each bucket: (requests per second, burst)
+RATE_LIMIT_BUDGETS: dict[XTRequestFamily, tuple[float, float]] = {
+    XTRequestFamily.ACCOUNT: (20, 40),
+    XTRequestFamily.SPECIFICATION: (10, 20),
+    XTRequestFamily.PROPERTIES: (10, 20),
+    XTRequestFamily.COMMANDS: (10, 20),
+    XTRequestFamily.OTHER: (10, 20),
+}
+
+class XTTokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until: float = 0
+        self.backoff_delay: float = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.dispatch_handle: asyncio.TimerHandle | None = None
+
+    def get_delay(self, now: float) -> float:
+        """Return the time to wait before a token is available."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def on_rate_limited(self, now: float) -> None:
+        self.get_delay(now)
+        self.rate = max(self.base_rate * RATE_LIMIT_MIN_RATE_RATIO, self.rate / 2)
+        self.backoff_delay = min(RATE_LIMIT_MAX_BACKOFF, max(RATE_LIMIT_INITIAL_BACKOFF, self.backoff_delay * 2))
+        self.paused_until = now + self.backoff_delay
+        self.tokens = 0
+
+    def on_success(self) -> None:
+        self.backoff_delay = 0
+        if self.rate < self.base_rate:
+            self.get_delay(time.monotonic())
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RATE_LIMIT_RECOVERY_RATIO)
+
+class XTRateLimiter:
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self.buckets: dict[tuple[str, XTRequestFamily], XTTokenBucket] = {}
+        self.sequence = itertools.count()
+
+    @staticmethod
+    def get_request_family(path: str) -> XTRequestFamily:
+        path = path.split("?", 1)[0]
+        if path.endswith("/commands") or path.endswith("/shadow/properties/issue"):
+            return XTRequestFamily.COMMANDS
+        if "/specification" in path:
+            return XTRequestFamily.SPECIFICATION
+        if path.endswith("/shadow/properties") or path.endswith("/model") or path.endswith("/status"):
+            return XTRequestFamily.PROPERTIES
+        return XTRequestFamily.OTHER
+
+    @staticmethod
+    def get_request_priority(family: XTRequestFamily) -> XTRequestPriority:
+        if family == XTRequestFamily.COMMANDS:
+            return XTRequestPriority.INTERACTIVE
+        return XTRequestPriority.BACKGROUND
+
+    @staticmethod
+    def is_rate_limited_response(response: Any) -> bool:
+        if not isinstance(response, dict) or response.get("success", True):
+            return False
+        message = str(response.get("msg", "")).lower()
+        return any(error_message in message for error_message in RATE_LIMIT_ERROR_MESSAGES)
+
+    def acquire(self, account: str, path: str) -> None:
+        """Wait for the budget of a request sent from a worker thread."""
+        if threading.get_ident() == self.hass.loop_thread_id:
+            #Never block the event loop, its requests must use async_acquire
+            return
+        asyncio.run_coroutine_threadsafe(self.async_acquire(account, path), self.hass.loop).result()
+
+    async def async_acquire(self, account: str, path: str) -> None:
+        family = XTRateLimiter.get_request_family(path)
+        priority = XTRateLimiter.get_request_priority(family)
+        for bucket in self._get_buckets(account, family):
+            await self._async_take(bucket, priority)
+
+    def report_response(self, account: str, path: str, response: Any) -> None:
+        """Adapt the budget of the account to the response of a request sent from a worker thread."""
+        self.hass.loop.call_soon_threadsafe(self.async_report_response, account, path, response)
+
+    @callback
+    def async_report_response(self, account: str, path: str, response: Any) -> None:
+        buckets = self._get_buckets(account, XTRateLimiter.get_request_family(path))
+        if XTRateLimiter.is_rate_limited_response(response):
+            LOGGER.debug(f"Tuya cloud rate limit reached for {account} ({path}), slowing down the requests")
+            now = time.monotonic()
+            for bucket in buckets:
+                bucket.on_rate_limited(now)
+        elif response is not None:
+            for bucket in buckets:
+                bucket.on_success()
+
+    def _get_buckets(self, account: str, family: XTRequestFamily) -> tuple[XTTokenBucket, XTTokenBucket]:
+        return (self._get_bucket(account, family), self._get_bucket(account, XTRequestFamily.ACCOUNT))
+
+    def _get_bucket(self, account: str, family: XTRequestFamily) -> XTTokenBucket:
+        if (account, family) not in self.buckets:
+            self.buckets[(account, family)] = XTTokenBucket(*RATE_LIMIT_BUDGETS[family])
+        return self.buckets[(account, family)]
+
+    async def _async_take(self, bucket: XTTokenBucket, priority: XTRequestPriority) -> None:
+        if not bucket.waiters and bucket.get_delay(time.monotonic()) == 0:
+            bucket.take()
+            return
+        future = self.hass.loop.create_future()
+        heapq.heappush(bucket.waiters, (priority, next(self.sequence), future))
+        self._dispatch(bucket)
+        await future
+
+    @callback
+    def _dispatch(self, bucket: XTTokenBucket) -> None:
+        if bucket.dispatch_handle is not None:
+            bucket.dispatch_handle.cancel()
+            bucket.dispatch_handle = None
+        while bucket.waiters:
+            delay = bucket.get_delay(time.monotonic())
+            if delay > 0:
+                bucket.dispatch_handle = self.hass.loop.call_later(delay, self._dispatch, bucket)
+                return
+            _, _, future = heapq.heappop(bucket.waiters)
+            if future.done():
+                #The request was cancelled while waiting
+                continue
+            bucket.take()
+            future.set_result(None)
@@ -1,12 +1,20 @@
 from __future__ import annotations
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 from types import SimpleNamespace
+from enum import StrEnum
+from functools import partial
 import copy
 from dataclasses import dataclass, field
 from ...util import (
     merge_iterables,
+    prepare_value_for_property_update,
 )
 
+VIRTUAL_DP_ID_BASE = 10000  #First dpId of the DPs added to the local_strategy for the virtual states
+
+#Attributes of a device set locally (indexes, caches, entity state), they are not part of the cloud data
+DEVICE_LOCAL_ATTRIBUTES = {"dp_code_index", "command_routes", "applied_virtual_states", "set_up"}
+
 @dataclass
 class XTDeviceProperties:
     local_strategy: dict[int, dict[str, Any]] = field(default_factory=dict)
@@ -16,20 +24,23 @@ class XTDeviceProperties:
     data_model: str = field(default_factory=str)
 
     def merge_in_device(self, device):
+        #The properties are built for this merge only and discarded afterwards, their values
+        #can be handed to the device without copying them
         if hasattr(device, "local_strategy"):
-            merge_iterables(device.local_strategy, self.local_strategy)
+            merge_iterables(device.local_strategy, self.local_strategy, deep_copy=False)
             #device.local_strategy.update(self.local_strategy)
         if hasattr(device, "status"):
-            merge_iterables(device.status, self.status)
+            merge_iterables(device.status, self.status, deep_copy=False)
             #device.status.update(self.status)
         if hasattr(device, "function"):
-            merge_iterables(device.function, self.function)
+            merge_iterables(device.function, self.function, deep_copy=False)
             #device.function.update(self.function)
         if hasattr(device, "status_range"):
-            merge_iterables(device.status_range, self.status_range)
+            merge_iterables(device.status_range, self.status_range, deep_copy=False)
             #device.status_range.update(self.status_range)
         if hasattr(device, "data_model"):
-            device.data_model = copy.deepcopy(self.data_model)
+            device.data_model = self.data_model
+        XTDevice.rebuild_dp_code_index(device)
 
 @dataclass
 class XTDeviceStatusRange:
@@ -88,6 +99,89 @@ class XTDevice(SimpleNamespace):
     def from_compatible_device(device):
         return XTDevice(**(device.__dict__))
     
+    @staticmethod
+    def get_dp_code_index(device) -> XTDeviceDpCodeIndex:
+        #Works for any device type (CustomerDevice, TuyaDevice, XTDevice)
+        local_strategy = getattr(device, "local_strategy", {})
+        dp_code_index: XTDeviceDpCodeIndex | None = getattr(device, "dp_code_index", None)
+        if dp_code_index is None or not dp_code_index.is_up_to_date(local_strategy):
+            dp_code_index = XTDeviceDpCodeIndex(local_strategy)
+            device.dp_code_index = dp_code_index
+        return dp_code_index
+
+    @staticmethod
+    def rebuild_dp_code_index(device) -> XTDeviceDpCodeIndex:
+        device.dp_code_index = XTDeviceDpCodeIndex(getattr(device, "local_strategy", {}))
+        return device.dp_code_index
+
+    @staticmethod
+    def get_command_routes(device, virtual_functions: tuple) -> XTDeviceCommandRoutes:
+        #Works for any device type (CustomerDevice, TuyaDevice, XTDevice)
+        dp_code_index = XTDevice.get_dp_code_index(device)
+        command_routes: XTDeviceCommandRoutes | None = getattr(device, "command_routes", None)
+        if command_routes is None or not command_routes.is_up_to_date(dp_code_index, virtual_functions):
+            command_routes = XTDeviceCommandRoutes(device, dp_code_index, virtual_functions)
+            device.command_routes = command_routes
+        return command_routes
+
+    @staticmethod
+    def copy_device_with_shared_specs(device):
+        #Copy a device for another manager, the status is copied but the specification
+        #objects (status_range, function and local_strategy entries, data_model) are shared
+        new_device = copy.copy(device)
+        new_device.status = dict(device.status)
+        new_device.function = dict(device.function)
+        new_device.status_range = dict(device.status_range)
+        if hasattr(device, "local_strategy"):
+            new_device.local_strategy = dict(device.local_strategy)
+        return new_device
+
+    @staticmethod
+    def set_local_strategy_config_value(device, dp_id: int, key: str, value: Any) -> None:
+        #local_strategy entries are shared by the devices of a product, copy the entry instead
+        #of modifying it in place
+        dp_item = device.local_strategy[dp_id]
+        config_item = dp_item.get("config_item", {})
+        if config_item.get(key, None) == value:
+            return
+        new_dp_item = dict(dp_item)
+        new_dp_item["config_item"] = {**config_item, key: value}
+        device.local_strategy[dp_id] = new_dp_item
+        XTDevice.invalidate_specification_caches(device)
+
+    @staticmethod
+    def set_specification_values(device, attribute: str, code: str, values: str) -> None:
+        #status_range and function objects are shared by the devices of a product too, copy the object
+        #instead of modifying it in place
+        specifications = getattr(device, attribute)
+        specification = specifications[code]
+        if specification.values == values:
+            return
+        new_specification = copy.copy(specification)
+        new_specification.values = values
+        specifications[code] = new_specification
+        XTDevice.invalidate_specification_caches(device)
+
+    @staticmethod
+    def invalidate_specification_caches(device) -> None:
+        #An entry of the specifications was replaced without changing their mappings,
+        #the virtual states have to be applied again and the command routes rebuilt
+        device.applied_virtual_states = None
+        device.command_routes = None
+
+    @staticmethod
+    def update_from_refreshed_device(device, refreshed_device) -> None:
+        #Copy the cloud data of a refreshed device into the device held by the entities,
+        #the replaced specifications invalidate the indexes and caches by themselves
+        for key, value in vars(refreshed_device).items():
+            if key in DEVICE_LOCAL_ATTRIBUTES:
+                continue
+            if key == "status" and isinstance(getattr(device, "status", None), dict):
+                #Keep the virtual states values, they are not reported by the cloud
+                device.status.update(value)
+                continue
+            setattr(device, key, value)
+
     def copy_data_from_device(source_device, dest_device) -> None:
         if hasattr(source_device, "online") and hasattr(dest_device, "online"):
             dest_device.online = source_device.online
@@ -95,4 +189,285 @@ class XTDevice(SimpleNamespace):
             dest_device.name = source_device.name
         if hasattr(source_device, "status") and hasattr(dest_device, "status"):
             for code, value in source_device.status.items():
-                dest_device.status[code] = value
\ No newline at end of file
+                dest_device.status[code] = value
+
+class XTDeviceDpCodeIndex:
+    """Bidirectional status_code <=> dpId index of a device local_strategy.
+
+    The index is rebuilt lazily when the local_strategy dict is replaced or
+    when its size changed since the index was built.
+    """
+
+    def __init__(self, local_strategy: dict[int, dict[str, Any]]) -> None:
+        self.local_strategy = local_strategy
+        self.code_to_dp_id: dict[str, int] = {}
+        self.dp_id_to_code: dict[int, str] = {}
+        for dp_id, dp_item in local_strategy.items():
+            self._index_dp_id(dp_id, dp_item.get("status_code", None))
+        self.strategy_size = len(local_strategy)
+        self.free_dp_id = VIRTUAL_DP_ID_BASE
+
+    def get_free_dp_id(self) -> int:
+        """Return the first free dpId for a virtual state DP."""
+        #The dpIds are allocated in increasing order, the cursor never has to go back
+        while self.free_dp_id in self.local_strategy:
+            self.free_dp_id += 1
+        return self.free_dp_id
+
+    def _index_dp_id(self, dp_id: int, code: str | None) -> None:
+        if code is None:
+            return
+        self.dp_id_to_code[dp_id] = code
+        if code not in self.code_to_dp_id:
+            #Keep the first dpId found for a code, like the previous linear scans did
+            self.code_to_dp_id[code] = dp_id
+
+    def add_dp_id(self, dp_id: int, code: str) -> None:
+        """Index a dpId that has just been added to the local_strategy."""
+        self._index_dp_id(dp_id, code)
+        self.strategy_size = len(self.local_strategy)
+
+    def is_up_to_date(self, local_strategy: dict[int, dict[str, Any]]) -> bool:
+        return local_strategy is self.local_strategy and len(local_strategy) == self.strategy_size
+
+class XTCommandBackend(StrEnum):
+    VIRTUAL_FUNCTION = "virtual_function"
+    SHARING = "sharing"
+    IOT = "iot"
+    IOT_PROPERTY = "iot_property"
+
+@dataclass
+class XTDeviceCommandRoute:
+    backend: XTCommandBackend
+    dp_id: int | None = None
+    value_encoder: Callable[[Any], Any] | None = None
+    virtual_function: Any = None
+
+    def encode_value(self, value: Any) -> Any:
+        if self.value_encoder is None:
+            return value
+        return self.value_encoder(value)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "dp_id": self.dp_id,
+            "value_encoder": getattr(getattr(self.value_encoder, "func", None), "__name__", None),
+        }
+
+class XTDeviceCommandRoutes:
+    """Command code => backend routing table of a device.
+
+    The table is rebuilt lazily when the dpCode index of the device changed
+    (properties merged, local_strategy replaced or extended) or when the
+    virtual functions of its category changed.
+    """
+
+    def __init__(self, device, dp_code_index: XTDeviceDpCodeIndex, virtual_functions: tuple) -> None:
+        self.dp_code_index = dp_code_index
+        self.strategy_size = dp_code_index.strategy_size
+        self.virtual_functions = virtual_functions
+        self.routes: dict[str, XTDeviceCommandRoute] = {}
+        #Virtual functions take precedence over the dpIds, the first matching one wins
+        for virtual_function in virtual_functions:
+            route = XTDeviceCommandRoute(XTCommandBackend.VIRTUAL_FUNCTION, virtual_function=virtual_function)
+            self.routes.setdefault(virtual_function.key, route)
+            for code in virtual_function.vf_reset_state:
+                self.routes.setdefault(code, route)
+        local_strategy = getattr(device, "local_strategy", {})
+        for code, dp_id in dp_code_index.code_to_dp_id.items():
+            if code in self.routes:
+                continue
+            dp_item = local_strategy[dp_id]
+            if not dp_item.get("use_open_api", False):
+                self.routes[code] = XTDeviceCommandRoute(XTCommandBackend.SHARING, dp_id)
+            elif dp_item.get("property_update", False):
+                self.routes[code] = XTDeviceCommandRoute(XTCommandBackend.IOT_PROPERTY, dp_id, partial(prepare_value_for_property_update, dp_item))
+            else:
+                self.routes[code] = XTDeviceCommandRoute(XTCommandBackend.IOT, dp_id)
+
+    def get_route(self, code: str) -> XTDeviceCommandRoute | None:
+        return self.routes.get(code, None)
+
+    def is_up_to_date(self, dp_code_index: XTDeviceDpCodeIndex, virtual_functions: tuple) -> bool:
+        return (
+            dp_code_index is self.dp_code_index
+            and dp_code_index.strategy_size == self.strategy_size
+            and virtual_functions is self.virtual_functions
+        )
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        return {code: route.as_dict() for code, route in self.routes.items()}
+
+class XTVirtualStatesApplication:
+    """Specifications of a device at the time its virtual states were applied.
+
+    Applying the virtual states again is only needed when the virtual states
+    of the category changed or when one of the specification mappings of the
+    device was replaced or got new entries. Replacing an entry of a mapping
+    drops the record instead (see XTDevice.invalidate_specification_caches).
+    """
+
+    SPECIFICATION_ATTRIBUTES = ("status", "status_range", "function", "local_strategy")
+
+    def __init__(self, device, virtual_states: tuple) -> None:
+        self.virtual_states = virtual_states
+        self.specifications = tuple(getattr(device, attribute, None) for attribute in XTVirtualStatesApplication.SPECIFICATION_ATTRIBUTES)
+        self.sizes = tuple(len(specification) if specification is not None else 0 for specification in self.specifications)
+
+    def is_up_to_date(self, device, virtual_states: tuple) -> bool:
+        if virtual_states is not self.virtual_states:
+            #The virtual states are compiled again each time descriptors are registered
+            if virtual_states != self.virtual_states:
+                return False
+            self.virtual_states = virtual_states
+        for attribute, specification, size in zip(XTVirtualStatesApplication.SPECIFICATION_ATTRIBUTES, self.specifications, self.sizes):
+            current_specification = getattr(device, attribute, None)
+            if current_specification is not specification:
+                return False
+            if current_specification is not None and len(current_specification) != size:
+                return False
+        return True
+
+class XTDeviceSpecificationPool:
+    """Flyweight pool sharing the specifications of the devices of a same product.
+
+    The function, status_range and local_strategy entries (and the data model)
+    of the devices of a same product are identical, equal entries are replaced
+    by a single shared instance so that only the status is kept per device.
+
+    The local_strategy entries are product templates shared between devices,
+    they are copied on write (see XTDevice.set_local_strategy_config_value)
+    and never modified in place.
+    """
+
+    def __init__(self) -> None:
+        self.specifications: dict[tuple, list[Any]] = {}
+        self.strings: dict[str, str] = {}
+        #(id of the source entry, new code, statusFormat renamed) => (source entry, clone)
+        self.local_strategy_clones: dict[tuple, tuple[dict[str, Any], dict[str, Any]]] = {}
+        #(id of the source specification, new code) => (source specification, clone)
+        self.specification_clones: dict[tuple, tuple[Any, Any]] = {}
+
+    def intern_device(self, device) -> None:
+        product_id = getattr(device, "product_id", None)
+        if not product_id:
+            return
+        for attribute in ("function", "status_range", "local_strategy"):
+            specification = getattr(device, attribute, None)
+            if not specification:
+                continue
+            for key, item in specification.items():
+                specification[key] = self._intern((attribute, product_id, key), item)
+        if data_model := getattr(device, "data_model", None):
+            device.data_model = self._intern(("data_model", product_id), data_model)
+
+    def get_local_strategy_clone(
+        self, dp_item: dict[str, Any], source_code: str, new_code: str, rename_status_format: bool
+    ) -> dict[str, Any]:
+        """Return the local_strategy entry of a virtual state DP copied from dp_item.
+
+        The clone only overrides the status_code (and the statusFormat), the rest
+        is shared with dp_item. All the devices whose dp_item is the same product
+        template get the same clone.
+        """
+        key = (id(dp_item), new_code, rename_status_format)
+        if (cached_clone := self.local_strategy_clones.get(key, None)) is not None and cached_clone[0] is dp_item:
+            return cached_clone[1]
+        clone = dict(dp_item)
+        clone["status_code"] = new_code
+        config_item = clone.get("config_item", None)
+        if rename_status_format and config_item and source_code in (config_item.get("statusFormat", None) or ""):
+            clone["config_item"] = {**config_item, "statusFormat": config_item["statusFormat"].replace(source_code, new_code)}
+        #The source entry is kept alive so that its id can't be reused by another entry
+        self.local_strategy_clones[key] = (dp_item, clone)
+        return clone
+
+    def get_specification_clone(self, specification: Any, new_code: str) -> Any:
+        """Return the status_range or function of a virtual state DP copied from specification."""
+        key = (id(specification), new_code)
+        if (cached_clone := self.specification_clones.get(key, None)) is not None and cached_clone[0] is specification:
+            return cached_clone[1]
+        clone = copy.copy(specification)
+        clone.code = new_code
+        self.specification_clones[key] = (specification, clone)
+        return clone
+
+    def _intern(self, key: tuple, item: Any) -> Any:
+        candidates = self.specifications.setdefault(key, [])
+        for candidate in candidates:
+            if candidate is item or (type(candidate) is type(item) and candidate == item):
+                return candidate
+        self._intern_strings(item)
+        candidates.append(item)
+        return item
+
+    def _intern_strings(self, item: Any) -> None:
+        #The values/valueDesc JSON strings are often identical across products too
+        if isinstance(item, dict):
+            attributes = item
+        elif hasattr(item, "__dict__"):
+            attributes = vars(item)
+        else:
+            return
+        for key, value in attributes.items():
+            if isinstance(value, str):
+                attributes[key] = self.strings.setdefault(value, value)
+            elif isinstance(value, dict):
+                self._intern_strings(value)
+
+class XTDeviceMap(dict):
+    """Device map notifying its listeners whenever a device is added or removed.
+
+    Listeners are called with the ID of the device that changed, or with None
+    when the whole map changed (clear, update...).
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.device_map_listeners: list[Callable[[str | None], None]] = []
+
+    def add_device_map_listener(self, listener: Callable[[str | None], None]) -> None:
+        self.device_map_listeners.append(listener)
+
+    def remove_device_map_listener(self, listener: Callable[[str | None], None]) -> None:
+        if listener in self.device_map_listeners:
+            self.device_map_listeners.remove(listener)
+
+    def _notify_listeners(self, device_id: str | None) -> None:
+        for listener in self.device_map_listeners:
+            listener(device_id)
+
+    def __setitem__(self, device_id: str, device) -> None:
+        super().__setitem__(device_id, device)
+        self._notify_listeners(device_id)
+
+    def __delitem__(self, device_id: str) -> None:
+        super().__delitem__(device_id)
+        self._notify_listeners(device_id)
+
+    def pop(self, device_id: str, *args):
+        had_device = device_id in self
+        return_value = super().pop(device_id, *args)
+        if had_device:
+            self._notify_listeners(device_id)
+        return return_value
+
+    def popitem(self):
+        device_id, device = super().popitem()
+        self._notify_listeners(device_id)
+        return device_id, device
+
+    def setdefault(self, device_id: str, default=None):
+        if device_id in self:
+            return self[device_id]
+        self[device_id] = default
+        return default
+
+    def clear(self) -> None:
+        super().clear()
+        self._notify_listeners(None)
+
+    def update(self, *args, **kwargs) -> None:
+        super().update(*args, **kwargs)
+        self._notify_listeners(None)
@@ -4,15 +4,37 @@ https://github.com/tuya/tuya-iot-python-sdk
 """
 
 from __future__ import annotations
+import asyncio
+import hashlib
+import hmac
 import json
 import copy
+import threading
+import time
+from functools import partial
+from requests.adapters import HTTPAdapter
 from tuya_iot import (
+    AuthType,
     TuyaDeviceManager,
     TuyaHomeManager,
     TuyaOpenAPI,
     TuyaOpenMQ,
 )
-from typing import Any
+from tuya_iot.device import (
+    TuyaDeviceFunction,
+    TuyaDeviceStatusRange,
+)
+from tuya_iot.openapi import (
+    TO_C_CUSTOM_REFRESH_TOKEN_API,
+    TO_C_CUSTOM_TOKEN_API,
+    TO_C_SMART_HOME_REFRESH_TOKEN_API,
+    TO_C_SMART_HOME_TOKEN_API,
+    TUYA_ERROR_CODE_TOKEN_INVALID,
+)
+from tuya_iot.version import VERSION as TUYA_IOT_VERSION
+from typing import Any, Coroutine
+
+from homeassistant.core import HomeAssistant
 
 from ...const import (
     LOGGER,
@@ -20,15 +42,29 @@ from ...const import (
     MESSAGE_SOURCE_TUYA_IOT,
 )
 
+from ...util import (
+    get_status_list_dp_codes,
+)
 from ..shared.shared_classes import (
     XTDeviceStatusRange,
     XTDeviceProperties,
     XTDevice,
+    XTDeviceMap,
+)
+from ..shared.device_snapshot import (
+    XTDeviceSnapshot,
+)
+from ..shared.async_http_client import (
+    XTAsyncHTTPClient,
+)
+from ..shared.rate_limiter import (
+    XTRateLimiter,
 )
 
 from ..multi_manager import (
     MultiManager,  # noqa: F811
 )
+from .xt_tuya_iot_model_cache import XTIOTModelCache
 from ...base import TuyaEntity
 
 class XTIOTHomeManager(TuyaHomeManager):
@@ -45,10 +81,162 @@ class XTIOTHomeManager(TuyaHomeManager):
         super().update_device_cache()
         #self.multi_manager.convert_tuya_devices_to_xt(self.device_manager)
 
+    def fetch_refreshed_device_map(self) -> XTDeviceMap:
+        #Fetch the devices with copies of the managers so that the current device map
+        #keeps serving the reports and the commands during the fetch
+        scratch_device_manager = copy.copy(self.device_manager)
+        scratch_device_manager.device_map = XTDeviceMap()
+        scratch_home_manager = copy.copy(self)
+        scratch_home_manager.device_manager = scratch_device_manager
+        scratch_home_manager.update_device_cache()
+        return scratch_device_manager.device_map
+
+class XTIOTTimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter applying a default timeout to the requests that don't set one."""
+
+    def __init__(self, timeout: float, *args, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout", None) is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+class XTIOTAsyncOpenAPI:
+    """Non blocking requests sharing the credentials and the token of a TuyaOpenAPI.
+
+    The requests are signed the same way as tuya-iot 0.6.6 does, the token
+    itself is still obtained and refreshed by the TuyaOpenAPI.
+    """
+
+    def __init__(self, hass: HomeAssistant, api: TuyaOpenAPI, http_client: XTAsyncHTTPClient, rate_limiter: XTRateLimiter) -> None:
+        self.hass = hass
+        self.api = api
+        self.http_client = http_client
+        self.rate_limiter = rate_limiter
+        #The blocking requests of the token refresh fallback get the same timeout as the non blocking ones
+        api.session.mount("https://", XTIOTTimeoutHTTPAdapter(http_client.timeout.total))
+
+    async def async_get(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        return await self.async_request("GET", path, params, None)
+
+    async def async_post(self, path: str, body: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        return await self.async_request("POST", path, None, body)
+
+    async def async_request(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | None:
+        await self.rate_limiter.async_acquire(MESSAGE_SOURCE_TUYA_IOT, path)
+        result = await self._async_send_request(method, path, params, body)
+        self.rate_limiter.async_report_response(MESSAGE_SOURCE_TUYA_IOT, path, result)
+        return result
+
+    async def _async_send_request(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | None:
+        if not self._is_token_valid():
+            #The token is refreshed (or the account reconnected) by the blocking Open API
+            return await self.hass.async_add_executor_job(self._request, method, path, params, body)
+        headers = self._get_headers(method, path, params, body)
+        data = None
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            data = json.dumps(body)
+        result = await self.http_client.async_request_json(method, self.api.endpoint + path, params, data, headers)
+        if result is not None and result.get("code", -1) == TUYA_ERROR_CODE_TOKEN_INVALID:
+            return await self.hass.async_add_executor_job(self._request, method, path, params, body)
+        return result
+
+    def _get_headers(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+    ) -> dict[str, str]:
+        access_token = self.api.token_info.access_token if self.api.token_info is not None else ""
+        t = int(time.time() * 1000)
+        headers = {
+            "client_id": self.api.access_id,
+            "sign": self._calculate_sign(method, path, params, body, access_token, t),
+            "sign_method": "HMAC-SHA256",
+            "access_token": access_token,
+            "t": str(t),
+            "lang": self.api.lang,
+        }
+        if self._is_token_request(path):
+            headers["dev_lang"] = "python"
+            headers["dev_version"] = TUYA_IOT_VERSION
+            headers["dev_channel"] = self.api.dev_channel
+        return headers
+
+    def _calculate_sign(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None,
+        body: dict[str, Any] | None,
+        access_token: str,
+        t: int,
+    ) -> str:
+        #https://developer.tuya.com/docs/iot/open-api/api-reference/singnature?id=Ka43a5mtx1gsc
+        content = "" if not body else json.dumps(body)
+        str_to_sign = f"{method}\n{hashlib.sha256(content.encode('utf8')).hexdigest().lower()}\n\n{path}"
+        if params:
+            str_to_sign += "?" + "&".join(f"{key}={params[key]}" for key in sorted(params))
+        message = self.api.access_id + access_token + str(t) + str_to_sign
+        return hmac.new(
+            self.api.access_secret.encode("utf8"),
+            msg=message.encode("utf8"),
+            digestmod=hashlib.sha256,
+        ).hexdigest().upper()
+
+    def _is_token_request(self, path: str) -> bool:
+        login_path = TO_C_CUSTOM_TOKEN_API if self.api.auth_type == AuthType.CUSTOM else TO_C_SMART_HOME_TOKEN_API
+        return (
+            path == login_path
+            or path.startswith(TO_C_CUSTOM_REFRESH_TOKEN_API)
+            or path.startswith(TO_C_SMART_HOME_REFRESH_TOKEN_API)
+        )
+
+    def _is_token_valid(self) -> bool:
+        #Same margin as the Open API before it refreshes its token
+        return self.api.is_connect() and self.api.token_info.expire_time - 60 * 1000 > int(time.time() * 1000)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: dict[str, Any] | None = None,
+    ) -> dict[str, Any] | None:
+        if method == "GET":
+            return self.api.get(path, params)
+        return self.api.post(path, body)
 
 class XTIOTDeviceManager(TuyaDeviceManager):
-    def __init__(self, multi_manager: MultiManager, api: TuyaOpenAPI, mq: TuyaOpenMQ) -> None:
+    def __init__(
+        self,
+        multi_manager: MultiManager,
+        api: TuyaOpenAPI,
+        mq: TuyaOpenMQ,
+        async_api: XTIOTAsyncOpenAPI,
+        model_cache: XTIOTModelCache | None = None,
+    ) -> None:
         super().__init__(api, mq)
+        self.model_cache = model_cache
+        self.async_api = async_api
+        self.device_send_locks: dict[str, asyncio.Lock] = {}
+        self.device_map: XTDeviceMap[str, XTDevice] = XTDeviceMap(self.device_map)
         mq.remove_message_listener(self.on_message)
         mq.add_message_listener(multi_manager.on_message_from_tuya_iot)
         self.multi_manager = multi_manager
@@ -118,14 +306,84 @@ class XTIOTDeviceManager(TuyaDeviceManager):
         self.update_device_function_cache()
     
     def update_device_function_cache(self, devIds: list = []):
-        super().update_device_function_cache(devIds)
-        for device_id in self.device_map:
-            device = self.device_map[device_id]
-            device_properties = self.get_device_properties(device)
-            device_properties.merge_in_device(device)
-            self.multi_manager.apply_init_virtual_states(device)
-            self.multi_manager.allow_virtual_devices_not_set_up(device)
+        devices = [
+            device for device in self.device_map.values()
+            if not devIds or device.id in devIds
+        ]
+        #Only the requests are sent from the event loop, the responses are applied from this thread
+        fetch_results = self._run_coroutine(self._async_fetch_devices_responses(devices))
+        for device, device_responses in zip(devices, fetch_results):
+            self._on_device_responses_fetched(device, device_responses)
+
+    def _on_device_responses_fetched(self, device: XTDevice, device_responses: tuple[dict[str, Any] | None, dict[str, Any] | None, str | None] | Exception) -> None:
+        if isinstance(device_responses, Exception):
+            LOGGER.warning(f"Fetching the properties of device {device.id} failed: {device_responses}")
+        else:
+            specification_response, properties_response, model = device_responses
+            self._apply_device_specification(device, specification_response)
+            if (device_properties := self._build_device_properties(device, properties_response, model)) is not None:
+                device_properties.merge_in_device(device)
+        #The model fix-up may have replaced specifications of the other devices with this ID too
+        for cur_device in self.multi_manager.get_devices_from_device_id(device.id):
+            if cur_device is not device:
+                self.multi_manager.apply_init_virtual_states(cur_device)
+        self.multi_manager.apply_init_virtual_states(device)
+        self.multi_manager.allow_virtual_devices_not_set_up(device)
+
+    async def _async_fetch_devices_responses(self, devices: list[XTDevice]) -> list[tuple[dict[str, Any] | None, dict[str, Any] | None, str | None] | Exception]:
+        return await asyncio.gather(
+            *(self._async_fetch_device_responses(device) for device in devices),
+            return_exceptions=True,
+        )
+
+    async def _async_fetch_device_responses(self, device: XTDevice) -> tuple[dict[str, Any] | None, dict[str, Any] | None, str | None]:
+        #Returns the specification response, the shadow properties response and the model of the device
+        specification_response = await self.async_api.async_get(self._get_device_specification_path(device.id))
+        return (specification_response, *await self._async_fetch_device_properties_responses(device))
 
+    def _apply_device_specification(self, device: XTDevice, response: dict[str, Any] | None) -> None:
+        if response is not None and response.get("success"):
+            result = response.get("result", {})
+            device.function = {function["code"]: TuyaDeviceFunction(**function) for function in result["functions"]}
+            device.status_range = {status["code"]: TuyaDeviceStatusRange(**status) for status in result["status"]}
+
+    def _get_device_specification_path(self, device_id: str) -> str:
+        #Same endpoints as the device management of the Open API
+        if self.api.auth_type == AuthType.SMART_HOME:
+            return f"/v1.0/devices/{device_id}/specifications"
+        return f"/v1.0/iot-03/devices/{device_id}/specification"
+
+    def _get_device_commands_path(self, device_id: str) -> str:
+        if self.api.auth_type == AuthType.SMART_HOME:
+            return f"/v1.0/devices/{device_id}/commands"
+        return f"/v1.0/iot-03/devices/{device_id}/commands"
+
+    def _run_coroutine(self, coroutine: Coroutine) -> Any:
+        """Run a coroutine on the event loop and wait for its result.
+
+        Only for the worker threads (device cache updates, properties), waiting
+        from the event loop would deadlock.
+        """
+        if threading.get_ident() == self.async_api.hass.loop_thread_id:
+            coroutine.close()
+            raise RuntimeError("Blocking Tuya Open API call from the event loop, use its async method instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.async_api.hass.loop).result()
+
+    def _run_or_schedule_coroutine(self, coroutine: Coroutine, description: str) -> None:
+        """Run a coroutine on the event loop, safe to call from any thread.
+
+        From a worker thread, waits for the coroutine and raises its errors. From
+        the event loop, the coroutine can't be waited for and its errors are logged.
+        """
+        if threading.get_ident() != self.async_api.hass.loop_thread_id:
+            self._run_coroutine(coroutine)
+            return
+        task = self.async_api.hass.async_create_task(coroutine)
+        task.add_done_callback(partial(self._log_task_error, description))
+
+    def _log_task_error(self, description: str, task: asyncio.Task) -> None:
+        if not task.cancelled() and (exception := task.exception()) is not None:
+            LOGGER.warning(f"{description}: {exception}")
 
     
     def on_message(self, msg: str):
@@ -134,13 +392,16 @@ class XTIOTDeviceManager(TuyaDeviceManager):
     def _on_device_other(self, device_id: str, biz_code: str, data: dict[str, Any]):
         return super()._on_device_other(device_id, biz_code, data)
 
+    def restore_device_map_from_snapshot(self, devices_data: list[dict[str, Any]]) -> None:
+        devices = [XTDeviceSnapshot.deserialize_device(device_data, XTDevice, TuyaDeviceFunction, TuyaDeviceStatusRange) for device_data in devices_data]
+        self.device_map.update({device.id: device for device in devices})
+
     def _on_device_report(self, device_id: str, status: list):
         device = self.device_map.get(device_id, None)
         if not device:
             return
-        status_new = self.multi_manager.convert_device_report_status_list(device_id, status)
-        status_new = self.multi_manager.multi_source_handler.filter_status_list(device_id, MESSAGE_SOURCE_TUYA_IOT, status_new)
-        status_new = self.multi_manager.apply_virtual_states_to_status_list(device, status_new)
+        status_new = self.multi_manager.convert_device_report_status_list(device, MESSAGE_SOURCE_TUYA_IOT, status)
+        self.multi_manager.multi_device_listener.add_reported_dp_codes(device_id, get_status_list_dp_codes(status_new))
         super()._on_device_report(device_id, status_new)
 
     def _update_device_list_info_cache(self, devIds: list[str]):
@@ -151,21 +412,43 @@ class XTIOTDeviceManager(TuyaDeviceManager):
             device_id = item["id"]
             self.device_map[device_id] = XTDevice(**item)
     
+    async def async_get_device_model(self, device: XTDevice) -> str | None:
+        if self.model_cache is None:
+            return await self._async_fetch_device_model(device.id)
+        return await self.model_cache.async_get_model(device.product_id, lambda: self._async_fetch_device_model(device.id))
+
+    async def _async_fetch_device_model(self, device_id: str) -> str | None:
+        response = await self.async_api.async_get(f"/v2.0/cloud/thing/{device_id}/model")
+        return self._get_model_from_response(response)
+
+    def _get_model_from_response(self, response: dict[str, Any] | None) -> str | None:
+        if not response or not response.get("success"):
+            return None
+        return response.get("result", {}).get("model", "{}")
+
     def get_device_properties(self, device: XTDevice) -> XTDeviceProperties | None:
+        #The responses are parsed and applied from this thread, not from the event loop
+        response, model = self._run_coroutine(self._async_fetch_device_properties_responses(device))
+        return self._build_device_properties(device, response, model)
+
+    async def _async_fetch_device_properties_responses(self, device: XTDevice) -> tuple[dict[str, Any] | None, str | None]:
+        response = await self.async_api.async_get(f"/v2.0/cloud/thing/{device.id}/shadow/properties")
+        model = await self.async_get_device_model(device)
+        return response, model
+
+    def _build_device_properties(self, device: XTDevice, response: dict[str, Any] | None, model: str | None) -> XTDeviceProperties | None:
         device_properties = XTDeviceProperties()
         device_properties.function = copy.deepcopy(device.function)
         device_properties.status_range = copy.deepcopy(device.status_range)
         device_properties.status = copy.deepcopy(device.status)
         if (hasattr(device, "local_strategy")):
-            device_properties.local_strategy = copy.deepcopy(device.local_strategy)
-        response = self.api.get(f"/v2.0/cloud/thing/{device.id}/shadow/properties")
-        response2 = self.api.get(f"/v2.0/cloud/thing/{device.id}/model")
-        if not response.get("success") or not response2.get("success"):
+            #The entries are copied on write, only the mapping needs a copy
+            device_properties.local_strategy = dict(device.local_strategy)
+        if not response or not response.get("success") or model is None:
             return
         
-        if response2.get("success"):
-            result = response2.get("result", {})
-            data_model = json.loads(result.get("model", "{}"))
+        if model is not None:
+            data_model = json.loads(model)
             device_properties.data_model = data_model
             for service in data_model["services"]:
                 for property in service["properties"]:
@@ -201,14 +484,15 @@ class XTIOTDeviceManager(TuyaDeviceManager):
                         #override it with the QueryThingsDataModel one
                         if real_type == DPType.ENUM: #Enums should not be altered since sometimes the model is wrong about them
                             continue
-                        devices = self.multi_manager.get_devices_from_device_id(device.id)
+                        #The device is not in the index while it is refreshed (see fetch_refreshed_device_map)
+                        devices = [device, *(cur_device for cur_device in self.multi_manager.get_devices_from_device_id(device.id) if cur_device is not device)]
                         for cur_device in devices:
                             if dp_id in cur_device.local_strategy:
-                                cur_device.local_strategy[dp_id]["config_item"]["valueDesc"] = typeSpec_json
+                                XTDevice.set_local_strategy_config_value(cur_device, dp_id, "valueDesc", typeSpec_json)
                                 if code in cur_device.status_range:
-                                    cur_device.status_range[code].values = typeSpec_json
+                                    XTDevice.set_specification_values(cur_device, "status_range", code, typeSpec_json)
                                 if code in cur_device.function:
-                                    cur_device.function[code].values = typeSpec_json
+                                    XTDevice.set_specification_values(cur_device, "function", code, typeSpec_json)
 
 
         if response.get("success"):
@@ -251,12 +535,41 @@ class XTIOTDeviceManager(TuyaDeviceManager):
                         device_properties.status[code] = dp_property.get("value",None)
         return device_properties
 
+    def send_commands(
+            self, device_id: str, commands: list[dict[str, Any]]
+    ):
+        self._run_or_schedule_coroutine(self.async_send_commands(device_id, commands), f"Commands scheduled for device {device_id}")
+
+    async def async_send_commands(
+            self, device_id: str, commands: list[dict[str, Any]]
+    ):
+        #The lock is taken before the first await so that the batches of a device are sent in order
+        async with self._get_device_send_lock(device_id):
+            response = await self.async_api.async_post(self._get_device_commands_path(device_id), {"commands": commands})
+            self._check_send_response(device_id, response)
+
     def send_property_update(
             self, device_id: str, properties: list[dict[str, Any]]
     ):
-        for property in properties:
-            for prop_key in property:
-                property_str = f"{{\"{prop_key}\":{property[prop_key]}}}"
-                #LOGGER.warning(f"send_property_update => {property_str}")
-                self.api.post(f"/v2.0/cloud/thing/{device_id}/shadow/properties/issue", {"properties": property_str}
-        )
\ No newline at end of file
+        self._run_or_schedule_coroutine(self.async_send_property_update(device_id, properties), f"Properties scheduled for device {device_id}")
+
+    async def async_send_property_update(
+            self, device_id: str, properties: list[dict[str, Any]]
+    ):
+        async with self._get_device_send_lock(device_id):
+            for property in properties:
+                for prop_key in property:
+                    property_str = f"{{\"{prop_key}\":{property[prop_key]}}}"
+                    response = await self.async_api.async_post(f"/v2.0/cloud/thing/{device_id}/shadow/properties/issue", {"properties": property_str})
+                    self._check_send_response(device_id, response)
+
+    def _check_send_response(self, device_id: str, response: dict[str, Any] | None) -> None:
+        if response is None:
+            raise RuntimeError(f"Sending commands to device {device_id} failed: no response")
+        if not response.get("success", False):
+            raise RuntimeError(f"Sending commands to device {device_id} failed: ({response.get('code', None)}) {response.get('msg', None)}")
+
+    def _get_device_send_lock(self, device_id: str) -> asyncio.Lock:
+        if device_id not in self.device_send_locks:
+            self.device_send_locks[device_id] = asyncio.Lock()
+        return self.device_send_locks[device_id]
@@ -0,0 +1,88 @@
+"""
+Persistent cache of the Tuya thing models, keyed by product ID.
+
+All the devices of a product share the same thing model, it is stored in
+Home Assistant's .storage so that it is fetched once per product instead of
+once per device, and not at all on a cold start. Cached models are used
+right away and revalidated in the background once per session.
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from ...const import (
+    DOMAIN,
+    LOGGER,
+)
+
+IOT_MODEL_CACHE_VERSION = 1
+IOT_MODEL_CACHE_SAVE_DELAY = 30
+
+class XTIOTModelCache:
+    def __init__(self, hass: HomeAssistant, entry_id: str) -> None:
+        self.hass = hass
+        self.store: Store[dict[str, Any]] = Store(hass, IOT_MODEL_CACHE_VERSION, XTIOTModelCache.get_storage_key(entry_id))
+        self.models: dict[str, dict[str, Any]] = {}
+        self.revalidated_product_ids: set[str] = set()
+        self.product_async_locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def get_storage_key(entry_id: str) -> str:
+        return f"{DOMAIN}.{entry_id}.iot_models"
+
+    @staticmethod
+    async def async_remove(hass: HomeAssistant, entry_id: str) -> None:
+        await Store(hass, IOT_MODEL_CACHE_VERSION, XTIOTModelCache.get_storage_key(entry_id)).async_remove()
+
+    async def async_load(self) -> None:
+        if (data := await self.store.async_load()) is not None:
+            self.models = data.get("models", {})
+
+    async def async_get_model(self, product_id: str | None, async_fetch_model: Callable[[], Awaitable[str | None]]) -> str | None:
+        """Return the model of a product, fetching it only if it is not cached yet."""
+        if not product_id:
+            return await async_fetch_model()
+        if product_id not in self.product_async_locks:
+            self.product_async_locks[product_id] = asyncio.Lock()
+        #Devices are fetched in parallel, only let one of them fetch a given product
+        async with self.product_async_locks[product_id]:
+            if (cached_model := self.models.get(product_id, None)) is not None:
+                self._schedule_async_revalidation(product_id, async_fetch_model)
+                return cached_model["model"]
+            model = await async_fetch_model()
+            if model is not None:
+                self._set_model(product_id, model)
+            return model
+
+    @callback
+    def _set_model(self, product_id: str, model: str) -> None:
+        self.models[product_id] = {"model": model, "updated": int(time.time())}
+        self.store.async_delay_save(self._data_to_save, IOT_MODEL_CACHE_SAVE_DELAY)
+
+    @callback
+    def _schedule_async_revalidation(self, product_id: str, async_fetch_model: Callable[[], Awaitable[str | None]]) -> None:
+        if product_id in self.revalidated_product_ids:
+            return
+        self.revalidated_product_ids.add(product_id)
+        self.hass.async_create_task(self._async_revalidate_model(product_id, async_fetch_model))
+
+    async def _async_revalidate_model(self, product_id: str, async_fetch_model: Callable[[], Awaitable[str | None]]) -> None:
+        try:
+            model = await async_fetch_model()
+        except Exception as e:
+            LOGGER.debug(f"Revalidation of the model of product {product_id} failed: {e}")
+            return
+        if model is None:
+            return
+        cached_model = self.models.get(product_id, None)
+        if cached_model is None or cached_model["model"] != model:
+            self._set_model(product_id, model)
+
+    @callback
+    def _data_to_save(self) -> dict[str, Any]:
+        return {"models": self.models}
@@ -3,7 +3,9 @@ This file contains all the code that inherit from Tuya integration
 """
 
 from __future__ import annotations
-from typing import Any
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 
 from homeassistant.core import HomeAssistant, callback
 
@@ -20,6 +22,7 @@ from tuya_sharing.home import (
 )
 from tuya_sharing.device import (
     CustomerDevice,
+    DeviceFunction,
     DeviceRepository,
     DeviceStatusRange,
 )
@@ -29,11 +32,25 @@ from ...const import (
     LOGGER,
     DPType,
     MESSAGE_SOURCE_TUYA_SHARING,
+    SHARING_DEVICE_FETCH_MAX_CONCURRENCY,
 )
 
 from ..multi_manager import (
     MultiManager,
 )
+from ...util import (
+    get_status_list_dp_codes,
+)
+from ..shared.shared_classes import (
+    XTDevice,
+    XTDeviceMap,
+)
+from ..shared.device_snapshot import (
+    XTDeviceSnapshot,
+)
+from ..shared.rate_limiter import (
+    XTRateLimiter,
+)
 
 from ...base import TuyaEntity
 
@@ -83,7 +100,7 @@ class XTSharingDeviceManager(Manager):
         self.device_repository = None
         self.scene_repository = None
         self.user_repository = None
-        self.device_map: dict[str, CustomerDevice] = {}
+        self.device_map: XTDeviceMap[str, CustomerDevice] = XTDeviceMap()
         self.user_homes: list[SmartLifeHome] = []
         self.device_listeners = set()
         self.other_device_manager = other_device_manager
@@ -106,19 +123,32 @@ class XTSharingDeviceManager(Manager):
 
     def set_overriden_device_manager(self, other_device_manager: Manager) -> None:
         self.other_device_manager = other_device_manager
+        self.multi_manager.rebuild_aggregated_device_map()
     
     def get_overriden_device_manager(self) -> Manager | None:
         if self.other_device_manager is not None:
             return self.other_device_manager
         return None
     
+    def restore_device_map_from_snapshot(self, devices_data: list[dict[str, Any]]) -> None:
+        devices = [XTDeviceSnapshot.deserialize_device(device_data, CustomerDevice, DeviceFunction, DeviceStatusRange) for device_data in devices_data]
+        self.device_map.update({device.id: device for device in devices})
+
+    def fetch_refreshed_device_map(self) -> XTDeviceMap:
+        #Fetch the devices with a copy of this manager so that the current device map
+        #keeps serving the reports and the commands during the fetch
+        scratch_manager = copy.copy(self)
+        scratch_manager.device_map = XTDeviceMap()
+        scratch_manager.update_device_cache()
+        self.user_homes = scratch_manager.user_homes
+        return scratch_manager.device_map
+
     def _on_device_report(self, device_id: str, status: list):
         device = self.device_map.get(device_id, None)
         if not device:
             return
-        status_new = self.multi_manager.convert_device_report_status_list(device_id, status)
-        status_new = self.multi_manager.multi_source_handler.filter_status_list(device_id, MESSAGE_SOURCE_TUYA_SHARING, status_new)
-        status_new = self.multi_manager.apply_virtual_states_to_status_list(device, status_new)
+        status_new = self.multi_manager.convert_device_report_status_list(device, MESSAGE_SOURCE_TUYA_SHARING, status)
+        self.multi_manager.multi_device_listener.add_reported_dp_codes(device_id, get_status_list_dp_codes(status_new))
         super()._on_device_report(device_id, status_new)
     
     def send_commands(
@@ -129,11 +159,86 @@ class XTSharingDeviceManager(Manager):
             return
         super().send_commands(device_id, commands)
 
+class XTSharingRateLimitedApi:
+    """CustomerApi whose requests go through the rate limiter of the sharing account."""
+
+    def __init__(self, customer_api: CustomerApi, rate_limiter: XTRateLimiter) -> None:
+        self.customer_api = customer_api
+        self.rate_limiter = rate_limiter
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.customer_api, name)
+
+    def get(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+        return self._request(self.customer_api.get, path, params)
+
+    def post(self, path: str, params: dict[str, Any] | None = None, body: dict[str, Any] | None = None) -> dict[str, Any]:
+        return self._request(self.customer_api.post, path, params, body)
+
+    def put(self, path: str, body: dict[str, Any] | None = None) -> dict[str, Any]:
+        return self._request(self.customer_api.put, path, body)
+
+    def delete(self, path: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
+        return self._request(self.customer_api.delete, path, params)
+
+    def _request(self, request: Callable[..., dict[str, Any]], path: str, *args) -> dict[str, Any]:
+        self.rate_limiter.acquire(MESSAGE_SOURCE_TUYA_SHARING, path)
+        try:
+            response = request(path, *args)
+        except Exception as e:
+            #CustomerApi raises "network error:(code) msg" instead of returning the unsuccessful responses
+            self.rate_limiter.report_response(MESSAGE_SOURCE_TUYA_SHARING, path, {"success": False, "msg": str(e)})
+            raise
+        self.rate_limiter.report_response(MESSAGE_SOURCE_TUYA_SHARING, path, response)
+        return response
+
 class XTSharingDeviceRepository(DeviceRepository):
-    def __init__(self, customer_api: CustomerApi, manager: XTSharingDeviceManager, multi_manager: MultiManager):
+    def __init__(
+        self,
+        customer_api: CustomerApi,
+        manager: XTSharingDeviceManager,
+        multi_manager: MultiManager,
+        max_concurrency: int = SHARING_DEVICE_FETCH_MAX_CONCURRENCY,
+    ):
         super().__init__(customer_api)
         self.manager = manager
         self.multi_manager = multi_manager
+        self.max_concurrency = max(1, max_concurrency)
+
+    def _query_devices(self, response) -> list[CustomerDevice]:
+        _devices = []
+        if response["success"]:
+            for item in response["result"]:
+                device = CustomerDevice(**item)
+                status = {}
+                for item_status in device.status:
+                    if "code" in item_status and "value" in item_status:
+                        code = item_status["code"]
+                        value = item_status["value"]
+                        status[code] = value
+                device.status = status
+                _devices.append(device)
+        self._update_devices_specification_and_strategy(_devices)
+        return _devices
+
+    def _update_devices_specification_and_strategy(self, devices: list[CustomerDevice]):
+        #The sharing API has no multi device query for the specifications and the strategies,
+        #fetch those of all the devices of the home in parallel, then finish the setup of the
+        #devices in order from this thread
+        if len(devices) > 1 and self.max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="xt_tuya_sharing") as executor:
+                futures = [executor.submit(self._fetch_device_specification_and_strategy, device) for device in devices]
+                for future in futures:
+                    future.result()
+        else:
+            for device in devices:
+                self._fetch_device_specification_and_strategy(device)
+        for device in devices:
+            self._on_device_strategy_info_updated(device)
+
+    def _fetch_device_specification_and_strategy(self, device: CustomerDevice):
+        self.update_device_specification(device)
+        self._update_device_strategy_info_mod(device)
 
     def update_device_specification(self, device: CustomerDevice):
         super().update_device_specification(device)
@@ -165,6 +270,7 @@ class XTSharingDeviceRepository(DeviceRepository):
             device.support_local = support_local
             #if support_local:                      #CHANGED
             device.local_strategy = dp_id_map       #CHANGED
+            XTDevice.rebuild_dp_code_index(device)
 
             #LOGGER.debug(
             #    f"device status strategy dev_id = {device_id} support_local = {support_local} local_strategy = {dp_id_map}")
@@ -172,6 +278,9 @@ class XTSharingDeviceRepository(DeviceRepository):
     def update_device_strategy_info(self, device: CustomerDevice):
         #super().update_device_strategy_info(device)
         self._update_device_strategy_info_mod(device=device)
+        self._on_device_strategy_info_updated(device)
+
+    def _on_device_strategy_info_updated(self, device: CustomerDevice):
         #Sometimes the Type provided by Tuya is ill formed,
         #replace it with the one from the local strategy
         for loc_strat in device.local_strategy.values():
@@ -252,6 +252,10 @@ class TuyaNumberEntity(TuyaEntity, NumberEntity):
                 self._uom.conversion_unit or self._uom.unit
             )
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on."""
+        return {self.entity_description.key}
+
     @property
     def native_value(self) -> float | None:
         """Return the entity value to represent the entity state."""
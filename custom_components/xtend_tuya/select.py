@@ -148,6 +148,10 @@ class TuyaSelectEntity(TuyaEntity, SelectEntity):
         ):
             self._attr_options = enum_type.range
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on."""
+        return {self.entity_description.key}
+
     @property
     def current_option(self) -> str | None:
         """Return the selected entity option to represent the entity state."""
@@ -634,6 +634,10 @@ class TuyaSensorEntity(TuyaEntity, RestoreSensor):
                 self._uom.conversion_unit or self._uom.unit
             )
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on."""
+        return {self.entity_description.key}
+
     @property
     def native_value(self) -> StateType:
         """Return the value reported by the sensor."""
@@ -281,6 +281,10 @@ class TuyaSwitchEntity(TuyaEntity, SwitchEntity):
         self.entity_description = description
         self._attr_unique_id = f"{super().unique_id}{description.key}"
 
+    def get_dependent_dp_codes(self) -> set[str] | None:
+        """Return the DP codes the entity state depends on."""
+        return {self.entity_description.key}
+
     @property
     def is_on(self) -> bool:
         """Return true if switch is on."""
@@ -3,7 +3,8 @@
 from __future__ import annotations
 import traceback 
 import copy
-from typing import NamedTuple
+from types import MappingProxyType
+from typing import Any, NamedTuple
 from homeassistant.core import HomeAssistant
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.helpers.entity import EntityDescription
@@ -73,13 +74,26 @@ def get_overriden_config_entry(hass: HomeAssistant, entry: XTConfigEntry, other_
             return od_config_entry
     return None
 
-def merge_iterables(iter1, iter2):
+def get_status_list_dp_codes(status: list[dict[str, Any]]) -> set[str] | None:
+    #Codes of the DPs of a (converted) status report, None if some of them are unknown
+    dp_codes: set[str] = set()
+    for item in status:
+        if (code := item.get("code", None)) is None:
+            #Unresolved dpId, the DPs that changed are unknown
+            return None
+        dp_codes.add(code)
+    return dp_codes
+
+def merge_iterables(iter1, iter2, deep_copy: bool = True):
+    #Make both mappings contain the union of their keys.
+    #When deep_copy is False, the values are shared between both mappings
+    #(only use it for values that are not modified in place afterwards)
     for item1 in iter1:
         if item1 not in iter2:
-            iter2[item1] = copy.deepcopy(iter1[item1])
+            iter2[item1] = copy.deepcopy(iter1[item1]) if deep_copy else iter1[item1]
     for item2 in iter2:
         if item2 not in iter1:
-            iter1[item2] = copy.deepcopy(iter2[item2])
+            iter1[item2] = copy.deepcopy(iter2[item2]) if deep_copy else iter2[item2]
 
 def get_tuya_integration_runtime_data(hass: HomeAssistant, entry: ConfigEntry, domain: str) -> TuyaIntegrationRuntimeData | None:
     if not entry:
@@ -115,45 +129,68 @@ def get_overriden_tuya_integration_runtime_data(hass: HomeAssistant, entry: Conf
         return get_tuya_integration_runtime_data(hass, overriden_config_entry, DOMAIN_ORIG)
     return None
 
-def merge_device_descriptors(descriptors1, descriptors2):
-    return_descriptors = copy.deepcopy(descriptors1)
-    for category in descriptors2:
+#Merged descriptor tables keyed by the identity of their source tables.
+#The source tables are module level constants of the platforms, keeping a reference
+#to them guarantees that their id is not reused while they are in the cache.
+MERGED_DESCRIPTORS_CACHE: dict[tuple[int, int], tuple[Any, Any, MappingProxyType]] = {}
+
+def merge_device_descriptors(descriptors1, descriptors2) -> MappingProxyType:
+    #The merge is only done once per process, reloading a config entry or adding another
+    #one reuses the read-only category -> descriptions table
+    cache_key = (id(descriptors1), id(descriptors2))
+    if cached_descriptors := MERGED_DESCRIPTORS_CACHE.get(cache_key):
+        return cached_descriptors[2]
+    merged_descriptors = MappingProxyType(_merge_device_descriptors(descriptors1, descriptors2))
+    MERGED_DESCRIPTORS_CACHE[cache_key] = (descriptors1, descriptors2, merged_descriptors)
+    return merged_descriptors
+
+def _merge_device_descriptors(descriptors1, descriptors2) -> dict:
+    #Entity descriptions are immutable, the returned table shares them with the source tables
+    return_descriptors = dict(descriptors1)
+    for category, category_item in descriptors2.items():
         if category not in return_descriptors:
             #Merge the whole category
-            return_descriptors[category] = copy.deepcopy(descriptors2[category])
+            return_descriptors[category] = category_item
         else:
             #Merge the content of the descriptor category
-            return_descriptors[category] = merge_descriptor_category(return_descriptors[category], descriptors2[category])
+            return_descriptors[category] = merge_descriptor_category(return_descriptors[category], category_item)
     return return_descriptors
 
 def merge_descriptor_category(category1: tuple[EntityDescription, ...], category2: tuple[EntityDescription, ...]):
-    descriptor1_key_list = []
-    return_category = copy.deepcopy(list(category1))
-    for descriptor in category1:
-        if descriptor.key not in descriptor1_key_list:
-            descriptor1_key_list.append(descriptor.key)
-    for descriptor in category2:
-        if descriptor.key not in descriptor1_key_list:
-            return_category.append(copy.deepcopy(descriptor))
-    return tuple(return_category)
+    descriptor1_keys = {descriptor.key for descriptor in category1}
+    return tuple(category1) + tuple(
+        descriptor for descriptor in category2 if descriptor.key not in descriptor1_keys
+    )
 
 def append_dictionnaries(dict1: dict, dict2: dict) -> dict:
-    return_dict = copy.deepcopy(dict1)
-    for category in dict2:
+    return_dict = dict(dict1)
+    for category, category_item in dict2.items():
         if category not in return_dict:
-            return_dict[category] = copy.deepcopy(dict2[category])
+            return_dict[category] = category_item
     return return_dict
 
 def append_lists(list1: list, list2: list) -> list:
-    return_list = copy.deepcopy(list(list1))
+    #Hashable items are deduplicated through a set, unhashable ones (scenes...)
+    #fall back to an equality check against the other unhashable items only
+    return_list = list(list1)
+    hashable_items = set()
+    unhashable_items = []
+    for item in return_list:
+        try:
+            hashable_items.add(item)
+        except TypeError:
+            unhashable_items.append(item)
     for item in list2:
-        if item not in return_list:
-            return_list.append(copy.deepcopy(item))
+        try:
+            if item in hashable_items:
+                continue
+            hashable_items.add(item)
+        except TypeError:
+            if item in unhashable_items:
+                continue
+            unhashable_items.append(item)
+        return_list.append(item)
     return return_list
 
 def append_sets(set1: set, set2: set) -> set:
-    return_set = set(copy.deepcopy(set1))
-    for item in set2:
-        if item not in return_set:
-            return_set.add(copy.deepcopy(item))
-    return return_set
\ No newline at end of file
+    return set(set1) | set(set2)